@@ -6,25 +6,77 @@ Attempts to extract text directly from PDF text stream, fallback to OCR as neces
 """
 
 from argparse import ArgumentParser, Namespace
-from dicttoxml import dicttoxml
-from io import IOBase
-from os import _exit, linesep, mkdir, path, remove
+from collections.abc import Callable, Generator, Iterable, Iterator
+from configparser import ConfigParser
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from hashlib import sha256
+from io import BytesIO, IOBase
+from multiprocessing import Pipe, Process, get_context
+from multiprocessing.connection import Connection, wait
+from os import _exit, cpu_count, linesep, mkdir, path, remove
 from pathlib import Path
 from pydantic import HttpUrl
+from queue import Queue
 from re import compile as _compile, search, split as _split
-from shutil import copyfileobj
+from shutil import copyfile, copyfileobj
 from socket import setdefaulttimeout
 from starlette import datastructures
 from sys import argv, stderr, stdout
 from tempfile import NamedTemporaryFile
+from threading import BoundedSemaphore, Lock
+from time import monotonic, sleep, time
+from unicodedata import category
 
+import http.client
 import json
 import logging
 import ocrmypdf
-from pdfminer.high_level import extract_pages
-from pdfminer.layout import LTTextContainer
+import os
+import pdfminer
+import pikepdf
+import signal
+import ssl
+import subprocess
+from pdfminer.converter import PDFPageAggregator
+from pdfminer.layout import LAParams, LTChar, LTFigure, LTImage, LTPage, LTTextContainer
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+from pdfminer.utils import open_filename
+from lxml import etree
 
-import urllib.error, urllib.parse, urllib.request
+import urllib.parse, urllib.request
+
+# optional, faster text backends
+try:
+    import pypdfium2
+    import pypdfium2.raw
+except ImportError:
+    pypdfium2 = None
+try:
+    import pymupdf
+except ImportError:
+    try:
+        import fitz as pymupdf
+    except ImportError:
+        pymupdf = None
+try:
+    import pdftotext
+except ImportError:
+    pdftotext = None
+# optional, several times faster JSON serialization
+try:
+    import orjson
+except ImportError:
+    orjson = None
+# optional, keeps Tesseract models loaded in the OCR pool
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
 
 # TODO: could this just be handled by one glob for dirs & files?
 PDF_RE = _compile(r"\.pdf$")
@@ -32,18 +84,141 @@ URL_RE = _compile(r"^https?://")
 # may need to revise this if OCRmyPDF output changes
 OCR_SKIP_PAGES_RE = _compile(r"^\[OCR skipped on page\(s\) ([0-9-]+)\]$")
 _SCRIPT_NAME_ = path.basename(__file__)
+# defaults for command-line args, later files and then PDFEXTRACT_* environment variables override earlier ones
+CONFIG_FILES = [Path(path.dirname(path.abspath(__file__)), "sample.ini"),
+                Path(path.dirname(path.abspath(__file__)), "pdfextract.ini")]
+CONFIG_KEYS = {"FORMAT": "output_format", "LANGS": "languages", "LOGLEVEL": "log_level", "WEB_PORT": "port"}
+ENV_PREFIX = "PDFEXTRACT_"
 OUTPUT_DIR_MODE = 0o755
+OUTPUT_EXTENSIONS = {"JSON": "json", "NDJSON": "jsonl", "TXT": "txt", "XML": "xml", "ALTO": "alto.xml"}
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" ?>'
+XML_BAD_CHARS_RE = _compile("[^\t\n\r\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]")  # not allowed in XML 1.0
+ALTO_NS = "http://www.loc.gov/standards/alto/ns-v4#"
+# "pages" has a dict per page with text_path & ocr_path, "compact" only the text of the path a page was routed to,
+# "text" all text in one string and no pages. See layout_result()
+OUTPUT_LAYOUTS = ["pages", "compact", "text"]
+OUTPUT_LAYOUT = "pages"
+MANIFEST_NAME = ".pdfextract_manifest.json"  # kept in the output directory by --sync
+MANIFEST_SAVE_INTERVAL = 10  # seconds, how often --sync saves progress while processing
+JOURNAL_NAME = ".pdfextract_journal.jsonl"  # documents done so far, kept in the output directory for --resume
 LOGLEVELS = ["ERROR", "INFO", "QUIET"]
-SUPPORTED_FORMATS = ["JSON", "TXT", "XML"]
+SUPPORTED_FORMATS = ["JSON", "NDJSON", "TXT", "XML", "ALTO"]
 LANGUAGES = "eng"
 TESSERACT_TIMEOUT = 59  # seconds
 HTTP_SOCK_TIMEOUT = 15  # seconds
+DOWNLOAD_WORKERS = 4  # URLs downloaded at the same time, also how far ahead a batch prefetches
+DOWNLOAD_MAX_MB = 200  # larger downloads are aborted
+DOWNLOAD_MAX_REDIRECTS = 5
+UPLOAD_MAX_MB = 200  # larger uploads are refused
+COPY_CHUNK = 1 << 16  # bytes read & written at a time when saving downloads and uploads
+# content types that can't be a PDF, rejected before reading the body
+DOWNLOAD_REJECT_TYPES_RE = _compile(r"^(text|image|audio|video)/|^application/(json|xml|xhtml\+xml|javascript)")
+_DOWNLOADER = None  # see get_downloader()
+_DOWNLOADER_LOCK = Lock()
+BATCH_WORKERS = 1  # documents processed concurrently, each in its own child process if > 1
+OCR_WORKERS = 1  # documents allowed in the OCR stage at the same time during a batch
+OCR_JOBS = None  # OCRmyPDF "jobs" per document, None means all cores
+FILE_TIMEOUT = None  # seconds, per document in a batch or sandbox. None means no limit
+FILE_MAX_RSS_MB = None  # resident memory of a document's child process and everything it starts, None means no limit
+FILE_MAX_PAGES = None  # documents with more pages to process are refused, None means no limit
+FILE_MAX_MPIXELS = None  # documents with more image megapixels (largest image of each page) are refused
+SANDBOX_POLL = 0.5  # seconds between memory checks of document child processes
+# globals that child processes starting from a fresh import (batch, sandbox, OCR chunks) get from their parent
+CHILD_SETTINGS = ["LANGUAGES", "TESSERACT_TIMEOUT", "TEXT_BACKEND", "CACHE_DIR", "CACHE_MAX_MB", "CACHE_MAX_AGE", "DOWNLOAD_MAX_MB", "MAX_PAGES", "FILE_MAX_PAGES",
+                    "FILE_MAX_MPIXELS", "TRIAGE", "OCR_ENGINE", "OCR_JOBS", "OCR_POOL_SIZE", "OCR_MAX_DPI",
+                    "OCR_MAX_MPIXELS", "OCR_PAGE_WORKERS", "OCR_PAGE_TIMEOUT"]
+_CHILD_CONTEXT = None  # see _child_context()
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+MAX_PAGES = None  # pages processed per document, None means all
+TEXT_BACKEND = "pdfminer"  # see TEXT_BACKENDS
+FAST_TEXT_BACKENDS = ["pypdfium2", "pymupdf", "poppler"]  # tried in this order by "auto"
+TEXT_BAD_CHARS_RATIO = 0.01  # "auto" falls back to PDFminer for pages with more unmappable chars
+# PDFminer text backends, as LAParams keyword args. None skips layout analysis, chars are joined in content stream order
+PDFMINER_PROFILES = {
+    "pdfminer": {},  # full layout analysis, text boxes ordered by boxes_flow
+    "pdfminer_tuned": {"boxes_flow": None, "detect_vertical": False},  # same boxes, simple top-down order
+    "pdfminer_fast": None,
+}
+RAW_TEXT_SPACE = 0.1  # "pdfminer_fast" adds a space between chars further apart than this fraction of char size, like LAParams.word_margin
+_PDFIUM_LOCK = Lock()
+OCR_ENGINES = ["ocrmypdf", "tesseract"]
+OCR_ENGINE = "ocrmypdf"  # "tesseract" OCRs rasterized pages on a pool of warm workers, see OCRPool
+OCR_POOL_SIZE = None  # OCRPool worker processes, None means all cores
+OCR_DPI = 300  # pages without a scanned image are rasterized at this resolution for the OCR pool
+# preprocessing is planned per page from its scanned image, see ocr_plans()
+OCR_MIN_DPI = 150  # scans below this resolution are upsampled to it, Tesseract misreads smaller glyphs
+OCR_MAX_DPI = 300  # scans above this resolution are downsampled to it before OCR, 0 means never
+OCR_MAX_MPIXELS = 250.0  # pages with a larger image are not OCR'd (left blank), it would take too much memory
+OCR_DESKEW_MAX_MPIXELS = 40.0  # scans with a larger image are not deskewed, it costs a second full-size copy
+_TESSERACT_LANGS = None  # see _tesseract_langs()
+OCR_PAGE_WORKERS = 1  # page chunks of one document OCR'd at the same time, each in its own process if > 1
+OCR_PAGE_TIMEOUT = 300  # seconds per page, wall clock, OCRmyPDF runs in a child process if set. None means no limit
+OCR_RETRIES = 1  # times pages of a failed OCR run are retried one by one
+# OCRmyPDF errors that retrying page by page won't fix
+OCR_FATAL_ERRORS = ["BadArgsError", "EncryptedPdfError", "InputFileError", "MissingDependencyError"]
+_OCR_POOL = None  # see get_ocr_pool()
+_OCR_POOL_LOCK = Lock()
+# metrics: (name, sorted label items) -> value, see add_metric() and format_prometheus()
+METRICS = {}
+STAGE_BUCKETS = [0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300]  # seconds, stage duration histogram
+_METRICS_LOCK = Lock()
+CACHE_DIR = None  # directory for cached results, None disables the cache
+CACHE_MAX_MB = 1024  # cache is trimmed to this size, least recently used first
+CACHE_MAX_AGE = 30  # days, cached results not used for longer are evicted
+CACHE_STATS = {"hit": 0, "miss": 0}
+CACHE_EVICT_INTERVAL = 60  # seconds, the cache is rescanned at most this often, unless it may be over CACHE_MAX_MB
+_CACHE_WRITTEN = 0  # bytes this process cached since its last cache_evict() scan
+_CACHE_LOCK = Lock()
+TRIAGE = True  # pre-scan PDF structure with pikepdf, see triage()
+TRIAGE_OPERATORS = "Tj TJ ' \" EI"  # text-showing operators, and the end of inline images
+TRIAGE_MAX_DEPTH = 3  # nested form XObjects deeper than this aren't scanned
+TRIAGE_TEXT_PAGE_SECONDS = 0.05  # rough per-page costs, for triage estimates
+TRIAGE_OCR_PAGE_SECONDS = 5.0
+# per-page routing thresholds, see route_page()
+ROUTE_MIN_CHARS = 20  # fewer non-whitespace chars than this is "no usable text layer"
+ROUTE_IMAGE_COVERAGE = 0.5  # fraction of page area covered by images
+ROUTE_TEXT_COVERAGE = 0.1  # fraction of page area covered by text boxes
 
 # -----------------------------------------------------------------------------
 
 
-def parse_params(app_mode: str = "CMDLINE") -> Namespace:
-    "parses command-line args, some different for CMDLINE or WEBAPI mode"
+def config_defaults(parser: ArgumentParser) -> dict:
+    """
+    returns defaults for parser's options from the [DEFAULT] section of CONFIG_FILES, then PDFEXTRACT_* environment
+    variables. Keys are option names (e.g.; CACHE_DIR) or the legacy names in CONFIG_KEYS. Unknown keys are ignored
+    """
+    config = ConfigParser()
+    config.read(CONFIG_FILES, encoding="utf-8")
+    items = list(config.defaults().items())
+    items += [(k[len(ENV_PREFIX):], v) for k, v in os.environ.items() if k.startswith(ENV_PREFIX)]
+    actions = {a.dest: a for a in parser._actions if a.option_strings}
+    defaults = {}
+    for key, value in items:
+        dest = CONFIG_KEYS.get(key.upper(), key.lower().replace("-", "_"))
+        action = actions.get(dest)
+        if action is None or dest == "help":
+            continue
+        try:
+            if action.nargs == 0:  # store_true flags
+                value = value.strip().lower() in ["1", "true", "yes", "on"]
+            elif action.nargs in ["*", "+"]:
+                value = value.split()
+            elif action.type is not None:
+                value = action.type(value)
+        except ValueError:
+            parser.error(f'bad value "{value}" for {key} in config or environment')
+        if action.choices is not None and value not in action.choices:
+            parser.error(f'{key} in config or environment must be one of {", ".join(action.choices)}')
+        defaults[dest] = value
+    return defaults
+
+
+# -----------------------------------------------------------------------------
+def parse_params(app_mode: str = "CMDLINE", argv: list[str] | None = None) -> Namespace:
+    """
+    parses command-line args (argv, None means sys.argv), some different for CMDLINE or WEBAPI mode.
+    options not given there default to config_defaults()
+    """
     parser = ArgumentParser()
 
     parser.add_argument(
@@ -54,7 +229,128 @@ def parse_params(app_mode: str = "CMDLINE") -> Namespace:
         help=f"optional: {', '.join(LOGLEVELS)}. If not specified, defaults to INFO",
     )
 
+    parser.add_argument(
+        "-cd",
+        "--cache_dir",
+        default=None,
+        help="optional: directory to cache results in, keyed by PDF content and settings. No cache by default",
+    )
+    parser.add_argument(
+        "-cm",
+        "--cache_max_mb",
+        type=int,
+        default=1024,
+        help="optional: maximum cache size in MB, least recently used results are evicted first. Defaults to 1024",
+    )
+    parser.add_argument(
+        "-ca",
+        "--cache_max_age",
+        type=int,
+        default=30,
+        help="optional: days after which unused cached results are evicted. Defaults to 30",
+    )
+
+    parser.add_argument(
+        "-dw",
+        "--download_workers",
+        type=int,
+        default=4,
+        help="optional: number of URLs downloaded at the same time, and prefetched ahead of processing. Defaults to 4",
+    )
+    parser.add_argument(
+        "-dm",
+        "--download_max_mb",
+        type=int,
+        default=200,
+        help="optional: downloads larger than this many MB are aborted. Defaults to 200",
+    )
+
+    parser.add_argument(
+        "-oe",
+        "--ocr_engine",
+        choices=OCR_ENGINES,
+        default="ocrmypdf",
+        help="optional: ocrmypdf runs the full OCRmyPDF pipeline per document, tesseract OCRs rasterized pages on a pool"
+        + " of long-lived workers (needs pypdfium2, and tesserocr to keep language models loaded). Defaults to ocrmypdf",
+    )
+    parser.add_argument(
+        "-pw",
+        "--ocr_page_workers",
+        type=int,
+        default=1,
+        help="optional: chunks of pages of one document OCR'd at the same time, cores are split between them. Defaults to 1",
+    )
+    parser.add_argument(
+        "-pt",
+        "--ocr_page_timeout",
+        type=int,
+        default=300,
+        help="optional: seconds per page after which an OCRmyPDF run (in its own process) is killed and its pages"
+        + " retried one by one. 0 means no limit, OCRmyPDF then runs in-process unless -pw > 1. Defaults to 300",
+    )
+    parser.add_argument(
+        "-od",
+        "--ocr_max_dpi",
+        type=int,
+        default=300,
+        help="optional: scans at a higher resolution are downsampled to this before OCR, to save time and memory."
+        + " 0 OCRs them at full resolution. Defaults to 300",
+    )
+    parser.add_argument(
+        "-om",
+        "--ocr_max_mpixels",
+        type=float,
+        default=250.0,
+        help="optional: pages with an image larger than this many megapixels are left blank instead of OCR'd."
+        + " Defaults to 250",
+    )
+    parser.add_argument(
+        "-ft",
+        "--file_timeout",
+        type=int,
+        default=None,
+        help="optional: maximum number of seconds to spend on a single document, including download and OCR. The"
+        + " document then runs in its own process, which is killed when it's over. No limit by default",
+    )
+    parser.add_argument(
+        "-fr",
+        "--file_max_rss_mb",
+        type=int,
+        default=None,
+        help="optional: maximum resident memory in MB of a single document, counting the OCR processes it starts."
+        + " The document then runs in its own process, which is killed when it's over. No limit by default",
+    )
+    parser.add_argument(
+        "-fp",
+        "--file_max_pages",
+        type=int,
+        default=None,
+        help="optional: documents with more pages to process are refused. No limit by default",
+    )
+    parser.add_argument(
+        "-fx",
+        "--file_max_mpixels",
+        type=float,
+        default=None,
+        help="optional: documents whose images (the largest of each page) add up to more megapixels are refused."
+        + " No limit by default",
+    )
+    parser.add_argument(
+        "-nt",
+        "--no_triage",
+        action="store_true",
+        help="don't pre-scan PDF structure with pikepdf before extraction. Triage rejects encrypted and corrupt PDFs"
+        + " early, and skips the text path for PDFs that only have images",
+    )
+
     if app_mode == "CMDLINE":
+        parser.add_argument(
+            "-in",
+            "--inspect",
+            action="store_true",
+            help="only triage inputs (page count, text or image-only pages, image DPI, encryption, corruption, cost"
+            + " estimate) without extracting anything, written to STDOUT as JSON, or NDJSON / XML if output_format is",
+        )
         parser.add_argument(
             "-l",
             "--languages",
@@ -73,7 +369,17 @@ def parse_params(app_mode: str = "CMDLINE") -> Namespace:
             "--output_format",
             choices=SUPPORTED_FORMATS,
             default="TXT",
-            help=f"optional: {', '.join(SUPPORTED_FORMATS)}. If not specified, defaults to TXT",
+            help=f"optional: {', '.join(SUPPORTED_FORMATS)}. If not specified, defaults to TXT. ALTO (v4 XML, text"
+            + " without coordinates) needs an output directory",
+        )
+        parser.add_argument(
+            "-ly",
+            "--layout",
+            choices=OUTPUT_LAYOUTS,
+            default="pages",
+            help="optional: pages has text_path and ocr_path of every page, compact only the text of the path each"
+            + " page was routed to, text all text of a PDF in one string. Applies to JSON, NDJSON and XML."
+            + " Defaults to pages",
         )
         parser.add_argument(
             "-op",
@@ -88,6 +394,59 @@ def parse_params(app_mode: str = "CMDLINE") -> Namespace:
             default=59,
             help="maximum number of seconds to spend on OCR operation, not including image processing",
         )
+        parser.add_argument(
+            "-tb",
+            "--text_backend",
+            choices=list(TEXT_BACKENDS),
+            default="pdfminer",
+            help="optional: engine for the text path. pdfminer_tuned skips ordering text boxes, pdfminer_fast skips"
+            + " layout analysis and keeps content stream order. pypdfium2, pymupdf and poppler are faster but need their"
+            + " modules installed, auto uses one of them and falls back to pdfminer for pages that look wrong."
+            + " Defaults to pdfminer",
+        )
+        parser.add_argument(
+            "-mp",
+            "--max_pages",
+            type=int,
+            default=None,
+            help="optional: process at most this many pages of each document. All pages by default",
+        )
+        parser.add_argument(
+            "-w",
+            "--workers",
+            type=int,
+            default=1,
+            help="optional: number of documents to process in parallel, each in its own process. Defaults to 1",
+        )
+        parser.add_argument(
+            "-ow",
+            "--ocr_workers",
+            type=int,
+            default=1,
+            help="optional: number of documents allowed to run OCR at the same time, cores are split between them. Defaults to 1",
+        )
+        parser.add_argument(
+            "-re",
+            "--resume",
+            action="store_true",
+            help="continue an interrupted run into output_path, skipping documents its journal records as done."
+            + " Needs an output directory",
+        )
+        parser.add_argument(
+            "-sy",
+            "--sync",
+            action="store_true",
+            help="only process PDFs that are new or changed since the last run into output_path, and remove outputs"
+            + " of PDFs that are gone. Progress is kept in a manifest in output_path. Needs an output directory",
+        )
+        parser.add_argument(
+            "-wa",
+            "--watch",
+            type=int,
+            default=None,
+            help="optional: with --sync, sync again every this many seconds until interrupted. Files modified more"
+            + " recently than that are left for the next sync",
+        )
         parser.add_argument(
             "input_paths",
             nargs="+",
@@ -114,7 +473,189 @@ def parse_params(app_mode: str = "CMDLINE") -> Namespace:
             default=8080,
             help="optional: run uvicorn/gunicorn on this port. Defaults to 8080.",
         )
-    return parser.parse_args()
+        parser.add_argument(
+            "-w",
+            "--workers",
+            type=int,
+            default=2,
+            help="optional: number of extraction requests processed at the same time. Defaults to 2",
+        )
+        parser.add_argument(
+            "-jw",
+            "--job_workers",
+            type=int,
+            default=1,
+            help="optional: number of jobs submitted to /jobs processed at the same time. Defaults to 1",
+        )
+        parser.add_argument(
+            "-jd",
+            "--job_db",
+            default="pdfextract_jobs.sqlite3",
+            help="optional: SQLite file to persist /jobs in, so queued work survives a restart. Defaults to 'pdfextract_jobs.sqlite3'",
+        )
+        parser.add_argument(
+            "-um",
+            "--upload_max_mb",
+            type=int,
+            default=200,
+            help="optional: uploads larger than this many MB are refused with HTTP 413. Defaults to 200",
+        )
+        parser.add_argument(
+            "-q",
+            "--queue_size",
+            type=int,
+            default=8,
+            help="optional: number of extraction requests allowed to wait, beyond that the API answers 503. Defaults to 8",
+        )
+        parser.add_argument(
+            "-sw",
+            "--server_workers",
+            type=int,
+            default=1,
+            help="optional: server processes, forked after imports so they share loaded modules. Each one runs"
+            + " 'workers' extraction requests at a time. 0 means enough to use all cores. Defaults to 1",
+        )
+        parser.add_argument(
+            "-rd",
+            "--recycle_documents",
+            type=int,
+            default=0,
+            help="optional: a server process is replaced after it processed this many documents, once its requests"
+            + " and jobs are done, to contain memory growth. 0 (default) means never",
+        )
+        parser.add_argument(
+            "-md",
+            "--metrics_dir",
+            default=None,
+            help="optional: directory where each server process keeps a copy of its counters, so /metrics reports"
+            + " the sum over all of them. Defaults to a temporary one with server_workers > 1 or recycle_documents",
+        )
+        parser.add_argument(
+            "--reload",
+            action="store_true",
+            help="development server: one process, restarted when the code changes",
+        )
+    parser.set_defaults(**config_defaults(parser))
+    return parser.parse_args(argv)
+
+
+# -----------------------------------------------------------------------------
+def add_metric(name: str, value: float = 1, **labels):
+    "adds value to counter name with labels"
+    key = (name, tuple(sorted(labels.items())))
+    with _METRICS_LOCK:
+        METRICS[key] = METRICS.get(key, 0) + value
+
+
+# -----------------------------------------------------------------------------
+def merge_metrics(metrics: dict):
+    "adds counters from another METRICS dict (e.g.; from a batch child process) to METRICS"
+    with _METRICS_LOCK:
+        for key, value in metrics.items():
+            METRICS[key] = METRICS.get(key, 0) + value
+
+
+# -----------------------------------------------------------------------------
+def save_metrics(file_path: str, **extra):
+    "writes METRICS and extra fields to file_path (atomically, it may be read any time), for load_metrics()"
+    with _METRICS_LOCK:
+        items = [[name, labels, value] for (name, labels), value in METRICS.items()]
+    with NamedTemporaryFile(
+        "w", encoding="utf-8", dir=path.dirname(file_path), suffix=".tmp", delete=False
+    ) as wfp:
+        json.dump({"metrics": items, **extra}, wfp)
+    os.replace(wfp.name, file_path)
+
+
+# -----------------------------------------------------------------------------
+def load_metrics(file_path: str | Path) -> tuple[dict, dict]:
+    "reads a save_metrics() file, returns its counters (keyed like METRICS) and its extra fields"
+    with open(file_path, "r", encoding="utf-8") as rfp:
+        data = json.load(rfp)
+    metrics = {
+        (name, tuple(tuple(label) for label in labels)): value for name, labels, value in data.pop("metrics")
+    }
+    return metrics, data
+
+
+# -----------------------------------------------------------------------------
+def observe_stage(stage: str, seconds: float, **labels):
+    "records duration of one run of a pipeline stage in the stage_seconds histogram"
+    add_metric("stage_seconds_sum", seconds, stage=stage, **labels)
+    add_metric("stage_seconds_count", 1, stage=stage, **labels)
+    for le in STAGE_BUCKETS + ["+Inf"]:  # every bucket, so each label set has the whole cumulative series
+        add_metric("stage_seconds_bucket", int(le == "+Inf" or seconds <= le), stage=stage, le=str(le), **labels)
+
+
+# -----------------------------------------------------------------------------
+@contextmanager
+def timed_stage(stage: str, **labels):
+    "times the with block as a run of stage, see observe_stage()"
+    start = monotonic()
+    try:
+        yield
+    finally:
+        observe_stage(stage, monotonic() - start, **labels)
+
+
+# -----------------------------------------------------------------------------
+def stage_seconds(stage: str) -> tuple[int, float]:
+    "returns how many times stage ran, and the seconds spent in it, over all labels"
+    with _METRICS_LOCK:
+        items = list(METRICS.items())
+    count = sum(v for (n, l), v in items if n == "stage_seconds_count" and ("stage", stage) in l)
+    total = sum(v for (n, l), v in items if n == "stage_seconds_sum" and ("stage", stage) in l)
+    return int(count), total
+
+
+# -----------------------------------------------------------------------------
+def _prometheus_order(item: tuple) -> tuple:
+    "sort key of a METRICS item: by metric, then label set, histogram buckets in numeric order then _sum, _count"
+    (name, labels), _ = item
+    histogram = name.startswith("stage_seconds_")
+    base, suffix = ("stage_seconds", name[len("stage_seconds_"):]) if histogram else (name, "")
+    le = dict(labels).get("le")
+    return (base, str(tuple(l for l in labels if l[0] != "le")), ["bucket", "sum", "count", ""].index(suffix),
+            float("inf") if le in [None, "+Inf"] else float(le))
+
+
+# -----------------------------------------------------------------------------
+def format_prometheus(metrics: dict | None = None) -> str:
+    "returns metrics (a dict like METRICS, METRICS itself by default) in Prometheus text exposition format"
+    with _METRICS_LOCK:
+        items = sorted((METRICS if metrics is None else metrics).items(), key=_prometheus_order)
+    lines = []
+    typed = set()
+    for (name, labels), value in items:
+        histogram = name.startswith("stage_seconds_")
+        base = "stage_seconds" if histogram else name
+        if base not in typed:
+            lines.append(f"# TYPE pdfextract_{base} {'histogram' if histogram else 'counter'}")
+            typed.add(base)
+        label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+        lines.append(f"pdfextract_{name}{{{label_str}}} {value}" if labels else f"pdfextract_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# -----------------------------------------------------------------------------
+def metrics_report() -> list[str]:
+    "returns a short human-readable summary of METRICS, one line per item"
+    with _METRICS_LOCK:
+        items = list(METRICS.items())
+    report = []
+    stages = sorted({dict(l)["stage"] for (n, l), _ in items if n == "stage_seconds_count"})
+    for stage in stages:
+        count, total = stage_seconds(stage)
+        report.append(f"stage {stage}: {count} runs, {total:.2f}s total, {total / count:.3f}s mean")
+    for name in ["documents_total", "pages_total", "cache_lookups_total", "downloads_total"]:
+        counts = {", ".join(f"{k}={v}" for k, v in l): v for (n, l), v in items if n == name}
+        if counts:
+            report.append(f"{name}: " + ", ".join(f"{k}: {v:g}" for k, v in sorted(counts.items())))
+    for name in ["download_bytes_total", "ocr_failures_total"]:
+        value = sum(v for (n, _), v in items if n == name)
+        if value:
+            report.append(f"{name}: {value:g}")
+    return report
 
 
 # -----------------------------------------------------------------------------
@@ -140,31 +681,314 @@ def set_up_logging(loglevel: str, logpath: str):
     )
 
 
+# -----------------------------------------------------------------------------
+def _download_cache_paths(url: str) -> tuple[Path, Path] | None:
+    "returns paths of the cached copy of url and of its validators (ETag, Last-Modified), or None if no cache"
+    if CACHE_DIR is None:
+        return None
+    key = sha256(url.encode("utf-8")).hexdigest()
+    cache_dir = Path(CACHE_DIR, "downloads")
+    return cache_dir / f"{key}.pdf", cache_dir / f"{key}.meta"
+
+
+# -----------------------------------------------------------------------------
+class Downloader:
+    """
+    downloads URLs over keep-alive connections pooled per host, at most `workers` at a time,
+    either on demand (fetch) or in the background ahead of use (prefetch, then take)
+    """
+
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        self._slots = BoundedSemaphore(self.workers)
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="pdfextract_download")
+        self._ssl_context = ssl.create_default_context()
+        self._lock = Lock()
+        self._idle = {}  # (scheme, host, port) -> idle connections
+        self._prefetched = {}  # URL -> Future of fetch()
+
+    def _connect(self, parts: urllib.parse.SplitResult
+                 ) -> tuple[tuple, http.client.HTTPConnection, str, bool]:
+        "returns pool key, an idle or new connection for parts' host, the request target to send, and if it was idle"
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        key = (parts.scheme, parts.hostname, port)
+        target = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+        with self._lock:
+            if self._idle.get(key):
+                return key, self._idle[key].pop(), target, True
+
+        proxy = urllib.request.getproxies().get(parts.scheme)
+        if proxy and not urllib.request.proxy_bypass(parts.hostname):
+            proxy_parts = urllib.parse.urlsplit(proxy)
+            proxy_port = proxy_parts.port or 80
+            if parts.scheme == "https":
+                conn = http.client.HTTPSConnection(
+                    proxy_parts.hostname, proxy_port, timeout=HTTP_SOCK_TIMEOUT, context=self._ssl_context
+                )
+                conn.set_tunnel(parts.hostname, port)
+            else:
+                conn = http.client.HTTPConnection(proxy_parts.hostname, proxy_port, timeout=HTTP_SOCK_TIMEOUT)
+                target = urllib.parse.urlunsplit(parts._replace(fragment=""))
+        elif parts.scheme == "https":
+            conn = http.client.HTTPSConnection(
+                parts.hostname, port, timeout=HTTP_SOCK_TIMEOUT, context=self._ssl_context
+            )
+        else:
+            conn = http.client.HTTPConnection(parts.hostname, port, timeout=HTTP_SOCK_TIMEOUT)
+        return key, conn, target, False
+
+    def _release(self, key: tuple, conn: http.client.HTTPConnection, resp: http.client.HTTPResponse):
+        "returns conn to the pool if resp was read to the end (draining a short rest) and the server keeps it open"
+        if not resp.isclosed():
+            resp.read(COPY_CHUNK)
+        if not resp.isclosed() or resp.will_close:
+            conn.close()
+            return
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.workers:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _get(self, url: str, headers: dict
+             ) -> tuple[tuple, http.client.HTTPConnection, http.client.HTTPResponse]:
+        "sends GET for url, retrying once on a fresh connection if a pooled one went stale, returns key, conn, response"
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ["http", "https"] or not parts.hostname:
+            raise ValueError(f"unsupported URL {url}")
+        while True:
+            key, conn, target, reused = self._connect(parts)
+            try:
+                conn.request("GET", target, headers=headers)
+                return key, conn, conn.getresponse()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                if not reused:
+                    raise
+                with self._lock:  # the others are likely stale too
+                    for idle in self._idle.pop(key, []):
+                        idle.close()
+
+    def _fetch(self, url: str) -> str | None:
+        "see fetch()"
+        cache_paths = _download_cache_paths(url)
+        meta = {}
+        if cache_paths is not None and cache_paths[0].is_file():
+            try:
+                meta = json.loads(cache_paths[1].read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                pass
+        headers = {"User-Agent": "pdfextract", "Accept": "application/pdf, */*;q=0.1"}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        location = url
+        for _ in range(DOWNLOAD_MAX_REDIRECTS + 1):
+            key, conn, resp = self._get(location, headers)
+            if resp.status in [301, 302, 303, 307, 308] and resp.getheader("Location"):
+                self._release(key, conn, resp)
+                location = urllib.parse.urljoin(location, resp.getheader("Location"))
+                continue
+            break
+        else:
+            logging.error(f'download "{url}" failed: more than {DOWNLOAD_MAX_REDIRECTS} redirects')
+            add_metric("downloads_total", result="error")
+            return None
+
+        tmp_file = NamedTemporaryFile(prefix=_SCRIPT_NAME_, suffix=".pdf", delete=False)
+        if resp.status == 304 and meta:
+            self._release(key, conn, resp)
+            try:
+                with open(cache_paths[0], "rb") as rfp:
+                    copyfileobj(rfp, tmp_file)
+                os.utime(cache_paths[0])  # recently used, for cache_evict()
+            except OSError:  # evicted meanwhile, fetch it again without validators
+                tmp_file.close()
+                remove(tmp_file.name)
+                cache_paths[1].unlink(missing_ok=True)
+                return self._fetch(url)
+            tmp_file.close()
+            add_metric("downloads_total", result="not_modified")
+            return tmp_file.name
+
+        error = None
+        content_type = resp.getheader("Content-Type", "")
+        content_length = resp.getheader("Content-Length", "")
+        max_bytes = DOWNLOAD_MAX_MB * (1 << 20)
+        if resp.status != 200:
+            error = f'code {resp.status}: "{resp.reason}"'
+        elif search(DOWNLOAD_REJECT_TYPES_RE, content_type.lower()):
+            error = f'content type "{content_type}" is not a PDF'
+        elif content_length.isdigit() and int(content_length) > max_bytes:
+            error = f"{content_length} bytes, over the {DOWNLOAD_MAX_MB} MB limit"
+        else:
+            head = b""  # the PDF header may follow up to 1KB of junk
+            try:
+                while chunk := resp.read(COPY_CHUNK):
+                    if tmp_file.tell() + len(chunk) > max_bytes:
+                        error = f"over the {DOWNLOAD_MAX_MB} MB limit"
+                        break
+                    if head is not None:
+                        head += chunk
+                        if len(head) >= 1024:
+                            if b"%PDF-" not in head[:1024]:
+                                error = "content is not a PDF"
+                                break
+                            head = None
+                    tmp_file.write(chunk)
+            except BaseException:  # e.g.; connection lost halfway
+                conn.close()
+                tmp_file.close()
+                remove(tmp_file.name)
+                raise
+            if error is None and head is not None and b"%PDF-" not in head:
+                error = "content is not a PDF"
+
+        if error is not None:
+            tmp_file.close()
+            remove(tmp_file.name)
+            if resp.status != 200:
+                self._release(key, conn, resp)
+                logging.error(f'download "{url}" failed with {error}')
+                add_metric("downloads_total", result="error")
+            else:
+                conn.close()  # rest of the body is unread
+                logging.error(f'download "{url}" rejected: {error}')
+                add_metric("downloads_total", result="rejected")
+            return None
+
+        self._release(key, conn, resp)
+        add_metric("download_bytes_total", tmp_file.tell())
+        add_metric("downloads_total", result="ok")
+        tmp_file.close()
+        validators = {"etag": resp.getheader("ETag"), "last_modified": resp.getheader("Last-Modified")}
+        if cache_paths is not None and any(validators.values()):
+            try:
+                cache_paths[0].parent.mkdir(parents=True, exist_ok=True)
+                copyfile(tmp_file.name, f"{cache_paths[0]}.tmp")
+                os.replace(f"{cache_paths[0]}.tmp", cache_paths[0])
+                cache_paths[1].write_text(json.dumps({"url": url, **validators}), encoding="utf-8")
+                cache_evict(cache_paths[0].stat().st_size)
+            except OSError as e:
+                logging.error(f'caching download "{url}" failed: {e}')
+        return tmp_file.name
+
+    def fetch(self, url: str) -> str | None:
+        """
+        takes URL, downloads it (following redirects, revalidating a cached copy with its ETag / Last-Modified),
+        returns it as NamedTemporaryFile name, or None if failed, isn't a PDF, or is over DOWNLOAD_MAX_MB
+        """
+        with self._slots:
+            try:
+                return self._fetch(url)
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                logging.error(f'download "{url}" failed: "{e}"')
+                add_metric("downloads_total", result="error")
+                return None
+
+    def prefetch(self, url: str):
+        "starts downloading url in the background, unless it already is"
+        with self._lock:
+            if url not in self._prefetched:
+                self._prefetched[url] = self._executor.submit(self.fetch, url)
+
+    def take(self, url: str) -> str | None:
+        "returns what fetch(url) returns, waiting for a prefetch of url if there is one"
+        with self._lock:
+            future = self._prefetched.pop(url, None)
+        if future is None:
+            return self.fetch(url)
+        return future.result()
+
+    def discard(self, urls: Iterable[str]):
+        "cancels prefetches of urls that weren't taken, removing files already downloaded"
+        for url in urls:
+            with self._lock:
+                future = self._prefetched.pop(url, None)
+            if future is not None and not future.cancel():
+                future.add_done_callback(_remove_download)
+
+
+# -----------------------------------------------------------------------------
+def _remove_download(future: Future):
+    "removes file downloaded by a prefetch that wasn't used"
+    if not future.cancelled() and future.result() is not None:
+        try:
+            remove(future.result())
+        except OSError:
+            pass
+
+
+# -----------------------------------------------------------------------------
+def get_downloader() -> Downloader:
+    "returns the process-wide Downloader, created on first use with DOWNLOAD_WORKERS"
+    global _DOWNLOADER
+    with _DOWNLOADER_LOCK:
+        if _DOWNLOADER is None:
+            _DOWNLOADER = Downloader(DOWNLOAD_WORKERS)
+        return _DOWNLOADER
+
+
 # -----------------------------------------------------------------------------
 def download_file(url: str) -> None | str:
+    "takes URL, downloads it (see Downloader.fetch), returns it as NamedTemporaryFile name or None if failed"
+    return get_downloader().take(url)
+
+
+# -----------------------------------------------------------------------------
+def iter_prefetched(resources: list) -> Iterator:
+    "yields resources in order, meanwhile downloading the URLs among the next DOWNLOAD_WORKERS of them"
+    downloader = get_downloader()
+    urls = set()
+    try:
+        for ii, resource in enumerate(resources):
+            for ahead in resources[ii:ii + 1 + downloader.workers]:
+                if not isinstance(ahead, (Path, datastructures.UploadFile)) and search(URL_RE, str(ahead)):
+                    downloader.prefetch(str(ahead))
+                    urls.add(str(ahead))
+            yield resource
+    finally:
+        downloader.discard(urls)
+
+
+# -----------------------------------------------------------------------------
+def save_upload(upload: datastructures.UploadFile) -> Path | None:
     """
-    takes URL, attempts to download file, returns it as NamedTemporaryFile name or None if failed.
-    catches HTTPError, URLError, Value & Type-Error
+    takes UploadFile, copies it COPY_CHUNK at a time to a NamedTemporaryFile, returns its Path.
+    returns None, leaving no file behind, if the upload is over UPLOAD_MAX_MB or can't be read
     """
-    # TODO: async?
-    req = urllib.request.Request(url)
+    max_bytes = UPLOAD_MAX_MB * (1 << 20)
+    tmp_file = NamedTemporaryFile(prefix=_SCRIPT_NAME_, suffix=".pdf", delete=False)
+    saved = False
     try:
-        resp = urllib.request.urlopen(req, timeout=HTTP_SOCK_TIMEOUT)
-    except urllib.error.HTTPError as e:
-        logging.error(f'download "{url}" failed with code {e.code}: "{e.reason}"')
-    except urllib.error.URLError as e:
-        logging.error(f'download "{url}" failed: "{e.reason}"')
-    except (TypeError, ValueError) as e:
-        logging.error(f'download "{url}" failed: "{e}"')
-    else:
-        tmp_file = NamedTemporaryFile(
-            prefix=_SCRIPT_NAME_, suffix=".pdf",
-            delete=False
-        )
-        copyfileobj(resp, tmp_file)
-        tmp_file.seek(0)
-        return tmp_file.name
-    return None
+        with tmp_file:
+            upload.file.seek(0)
+            while chunk := upload.file.read(COPY_CHUNK):
+                if tmp_file.tell() + len(chunk) > max_bytes:
+                    logging.error(f'upload "{upload.filename}" is over the {UPLOAD_MAX_MB} MB limit')
+                    return None
+                tmp_file.write(chunk)
+        saved = True
+    except (OSError, ValueError) as e:  # ValueError if the upload was closed already
+        logging.error(f'saving upload "{upload.filename}" failed: {e}')
+        return None
+    finally:
+        if not saved:
+            remove(tmp_file.name)
+    return Path(tmp_file.name)
+
+
+# -----------------------------------------------------------------------------
+def resource_name(resource: Path | datastructures.UploadFile | HttpUrl | str) -> str:
+    "takes local file Path, UploadFile or URL, returns the basename its results are named by"
+    if isinstance(resource, Path):
+        return resource.name
+    if isinstance(resource, datastructures.UploadFile):
+        return resource.filename
+    return urllib.parse.quote(urllib.parse.urlparse(str(resource)).path.split("/")[-1])
 
 
 # -----------------------------------------------------------------------------
@@ -180,22 +1004,17 @@ def file_details(
         if not file_obj.is_file():
             file_obj = None
         else:
-            basename = resource.name
+            basename = resource_name(resource)
     elif isinstance(resource, datastructures.UploadFile):
-        basename = resource.filename
-        tmp_file = NamedTemporaryFile(
-            prefix=_SCRIPT_NAME_, suffix=".pdf",
-            delete=False
-        )
-        tmp_file.write(resource.file.read())
-        tmp_file.seek(0)
-        file_obj = Path(tmp_file.name)
+        basename = resource_name(resource)
         logging.info(f'Processing uploaded file "{basename}"')
+        with timed_stage("upload"):
+            file_obj = save_upload(resource)
     else:  # assuming URL
         resource = str(resource)
         logging.info(f'Processing "{resource}"')
         url_parts = urllib.parse.urlparse(resource)
-        basename = urllib.parse.quote(url_parts.path.split("/")[-1])
+        basename = resource_name(resource)
         s = url_parts.scheme.lower()
         # other schemes (ftp, etc,..)?
         if (
@@ -206,148 +1025,1831 @@ def file_details(
             logging.error(f'URL "{resource}" seems to be malformed, not downloading')
             file_obj = None
         else:
-            file_obj = download_file(resource)
+            with timed_stage("download"):
+                file_obj = download_file(resource)
     return file_obj, basename
 
 
 # -----------------------------------------------------------------------------
-def process_text_path(file_obj: Path | IOBase) -> list[str] | None:
-    "takes PDF resource, processes pages containing text, returns list of text str in pages"
-    # TODO: tables ( PDFplumber), images, annotations
-    pdf_text = []
-    try:
-        for page_layout in extract_pages(file_obj):
-            page_text = ""
-            for element in page_layout:
-                if isinstance(element, LTTextContainer):
-                    page_text += linesep + element.get_text().strip() + linesep
-            pdf_text.append(page_text)
-    except Exception as e:  # TODO: investig8 specific PDFminer exceptions
-        logging.error(f"PDFminer oops: {e}")
-    return pdf_text
+def _image_area(element) -> float:
+    "takes pdfminer layout element, returns summed area of LTImage objects found in it (recursing into LTFigure)"
+    if isinstance(element, LTImage):
+        return element.width * element.height
+    if isinstance(element, LTFigure):
+        return sum(_image_area(child) for child in element)
+    return 0.0
 
 
 # -----------------------------------------------------------------------------
-def process_ocr_path(file_obj: Path | IOBase, languages: str, tesseract_timeout: int
-                     ) -> list[str] | None:
-    # TODO: could memory be an issue? https://github.com/ocrmypdf/OCRmyPDF/issues/115
-    # TODO: supporting GPUs? see https://github.com/ocrmypdf/OCRmyPDF/issues/221
-    # TODO: look into options --rotate-pages, --remove-background, --clean, --invalidate-digital-signatures, --max-image-mpixels, --rotate-pages-threshold, all --tesseract* (see ocrmypdf --help)
-    "takes PDF resource, processes OCR pages, returns list of text in pages"
-    tmp_file = NamedTemporaryFile(prefix=_SCRIPT_NAME_, suffix=".txt")
-    try:
-        result = ocrmypdf.ocr(
-            file_obj,
-            path.devnull,
-            continue_on_soft_render_error=True,
-            deskew=True,
-            language=languages,
-            output_type="none",
-            progress_bar=False,
-            sidecar=tmp_file.name,
-            skip_text=True,
-            # force_ocr=True,
-            tesseract_timeout=tesseract_timeout,
-        )
-        with open(tmp_file.name, "rb") as rfp:
-            text = str(rfp.read(), "utf-8")
-    except Exception as e:
-        # TODO: some exceptions may be recoverable or have a "workaround"; not
-        # necessarily result in "fail"
-        logging.error(f"OCRmyPDF oops: {e}")
-        return None
-    return insert_skipped_pages([p.strip() for p in text.split("\f")])
+def page_stats(page_layout: LTPage, page_text: str) -> dict:
+    "takes pdfminer page layout and its extracted text, returns char count, text & image coverage (fractions of page area)"
+    page_area = page_layout.width * page_layout.height
+    text_area = image_area = 0.0
+    for element in page_layout:
+        if isinstance(element, LTTextContainer):
+            text_area += element.width * element.height
+        else:
+            image_area += _image_area(element)
+    return {
+        "count_char": len("".join(page_text.split())),
+        "text_coverage": min(text_area / page_area, 1.0) if page_area else 0.0,
+        "image_coverage": min(image_area / page_area, 1.0) if page_area else 0.0,
+    }
 
 
 # -----------------------------------------------------------------------------
-def insert_skipped_pages(pages: list) -> list:
-    "replaces OCRmyPDF compressed skip pages output with blank pages in list"
-    _pages = []
-    for page in pages:
-        if len(page) < 100:    # otherwise too long to be page skip text
-            matched = search(OCR_SKIP_PAGES_RE, _split(r"[\r\n]+", page, maxsplit=1)[0])
-            if matched:
-                _range = matched.group(1).split("-")
-                start = int(_range[0])
-                end = int(_range[1]) if len(_range) > 1 else start
-                count_skip_page = end - start + 1
-                _pages.extend([""] * count_skip_page)
-                continue
-        _pages.append(page)
-    return _pages
+def _scan_content(content: pikepdf.Page | pikepdf.Object, resources: pikepdf.Object | None, depth: int = 0) -> dict:
+    "takes page or form XObject and its /Resources, returns its font names, text-showing operator count and images"
+    found = {"fonts": set(), "text_ops": 0, "images": []}  # images as (width, height), 0 if unknown
+    if not isinstance(resources, pikepdf.Dictionary):  # missing, or malformed
+        resources = pikepdf.Dictionary()
+    fonts = resources.get("/Font")
+    if isinstance(fonts, pikepdf.Dictionary):
+        found["fonts"].update(str(k) for k in fonts.keys())
+    for instruction in pikepdf.parse_content_stream(content, TRIAGE_OPERATORS):
+        if str(instruction.operator) == "EI":  # inline image
+            found["images"].append((0, 0))
+        else:
+            found["text_ops"] += 1
+    xobjects = resources.get("/XObject")
+    for xobject in xobjects.values() if isinstance(xobjects, pikepdf.Dictionary) else []:
+        if not isinstance(xobject, pikepdf.Stream):  # XObjects are streams, anything else is malformed
+            continue
+        if xobject.get("/Subtype") == "/Image":
+            found["images"].append((int(xobject.get("/Width", 0)), int(xobject.get("/Height", 0))))
+        elif xobject.get("/Subtype") == "/Form" and depth < TRIAGE_MAX_DEPTH:
+            inner = _scan_content(xobject, xobject.get("/Resources"), depth + 1)
+            found["fonts"] |= inner["fonts"]
+            found["text_ops"] += inner["text_ops"]
+            found["images"] += inner["images"]
+    return found
 
 
 # -----------------------------------------------------------------------------
-def process_file_or_url(
-    resource: Path | datastructures.UploadFile | HttpUrl | str,
-    languages: str | None = None,
-    tesseract_timeout: int | None = None,
-) -> dict:
-    "takes PDF resource, tries text extraction through text path, then OCR. returns dict with fail/success status, basename, text, and page count"
-    if languages is None:
-        languages = LANGUAGES
-    if tesseract_timeout is None:
-        tesseract_timeout = TESSERACT_TIMEOUT
+def _triage_page(page: pikepdf.Page, page_ind: int) -> dict:
+    "takes pikepdf page, returns its kind ('text', 'image', 'mixed', 'blank' or 'corrupt'), what was found, image DPI"
+    try:
+        found = _scan_content(page, page.resources)
+        mediabox = [float(v) for v in page.mediabox]
+    except Exception as e:  # whatever a malformed page throws, it mustn't take the document down
+        return {"page_ind": page_ind, "kind": "corrupt", "error": f"{type(e).__name__}: {e}"}
+    if found["text_ops"]:
+        kind = "mixed" if found["images"] else "text"
+    else:
+        kind = "image" if found["images"] else "blank"
+    # resolution of the largest image, as if it covered the page, which scans do
+    width_in, height_in = (mediabox[2] - mediabox[0]) / 72, (mediabox[3] - mediabox[1]) / 72
+    width, height = max(found["images"], key=lambda wh: wh[0] * wh[1], default=(0, 0))
+    image_dpi = round(max(width / width_in, height / height_in)) if width and width_in and height_in else None
+    return {"page_ind": page_ind, "kind": kind, "count_font": len(found["fonts"]), "count_text_op": found["text_ops"],
+            "count_image": len(found["images"]), "image_dpi": image_dpi,
+            "image_mpixels": round(width * height / 1e6, 2), "size_in": [round(width_in, 2), round(height_in, 2)]}
 
-    resource_temporary = not isinstance(resource, Path)
-    file_obj, basename = file_details(resource)
-    ret_val = {"name": resource, "status": "fail"}
 
-    if file_obj is None:
-        logging.error(f'failed to locate FileOrURL "{resource}"')
-        return ret_val
-    ret_val["name"] = basename
+# -----------------------------------------------------------------------------
+def triage(file_obj: Path | str) -> dict:
+    """
+    takes local PDF file, looks only at its structure with pikepdf (no text or layout analysis), returns dict with
+    status ('ok', 'encrypted' or 'corrupt'), count_page, a triage dict per page (up to MAX_PAGES), the route the
+    document needs ('text', 'ocr' or 'mixed') and a rough estimate of the seconds processing it will take
+    """
+    with timed_stage("triage"):
+        try:
+            pdf = pikepdf.open(file_obj)
+        except pikepdf.PasswordError:
+            return {"status": "encrypted", "error": "a password is needed to open it"}
+        except (pikepdf.PdfError, OSError) as e:
+            return {"status": "corrupt", "error": str(e)}
+        with pdf:
+            pages = [
+                _triage_page(page, page_ind)
+                for page_ind, page in enumerate(pdf.pages[:MAX_PAGES], 1)
+            ]
+            count_page = len(pdf.pages)
+            encrypted = pdf.is_encrypted  # with an owner password only, so it opened anyway
+            warnings = pdf.get_warnings() if hasattr(pdf, "get_warnings") else []
+    kinds = {p["kind"] for p in pages}
+    if "image" in kinds and kinds <= {"image", "blank"}:
+        route = "ocr"
+    elif kinds <= {"text", "blank"}:
+        route = "text"
+    else:
+        route = "mixed"
+    estimate = sum(
+        TRIAGE_TEXT_PAGE_SECONDS + (TRIAGE_OCR_PAGE_SECONDS if p["kind"] in ["image", "mixed"] else 0)
+        for p in pages
+    )
+    return {"status": "ok", "encrypted": encrypted, "count_page": count_page, "route": route,
+            "estimated_seconds": round(estimate, 2), "warnings": [str(w) for w in warnings], "pages": pages}
 
-    pages_text_path = process_text_path(file_obj)  # could be None on Error
-    count_page = len(pages_text_path)  # this also applies to OCR-only PDFs
-    ret_val["count_page"] = count_page
-    pages_ocr_path = process_ocr_path(file_obj, languages, tesseract_timeout)
 
-    if hasattr(file_obj, "close"):
-        file_obj.close()
-    if (isinstance(file_obj, str) or isinstance(file_obj, Path)) and resource_temporary:
-        remove(file_obj)
+# -----------------------------------------------------------------------------
+def failure_result(name: str, kind: str, error: str, **details) -> dict:
+    """
+    returns the fail result of a document that was stopped or refused: {'name', 'status', 'error', 'failure'}, where
+    failure has the kind ('timeout', 'memory', 'crash', 'pages', 'mpixels', 'encrypted' or 'corrupt') and details
+    """
+    return {"name": name, "status": "fail", "error": error, "failure": {"kind": kind, **details}}
 
-    pages = []
-    for page_ind, page in enumerate(pages_text_path, 1):  # 1-based counting  :-D
-        ocr_path = pages_ocr_path[page_ind - 1] if len(pages_ocr_path) >= page_ind else ""
-        pages.append({"page_ind": page_ind, "text_path": page,
-                     "ocr_path": ocr_path})
 
-    return {
-        "name": basename,
-        "count_page": count_page,
-        "status": "success",
-        "pages": pages
-    }
+# -----------------------------------------------------------------------------
+def check_limits(scan: dict) -> tuple[str, str, float, float] | None:
+    "takes triage() of a PDF, returns (kind, error, limit, value) if it's over FILE_MAX_PAGES or FILE_MAX_MPIXELS"
+    count_page = min(scan["count_page"], MAX_PAGES or scan["count_page"])
+    if FILE_MAX_PAGES and count_page > FILE_MAX_PAGES:
+        return "pages", f"{count_page} pages, over the {FILE_MAX_PAGES} page limit", FILE_MAX_PAGES, count_page
+    mpixels = round(sum(p.get("image_mpixels", 0) for p in scan["pages"]), 2)
+    if FILE_MAX_MPIXELS and mpixels > FILE_MAX_MPIXELS:
+        return "mpixels", f"{mpixels} megapixels of images, over the {FILE_MAX_MPIXELS} limit", FILE_MAX_MPIXELS, mpixels
+    return None
 
 
 # -----------------------------------------------------------------------------
-def get_all_text(pdf: dict) -> str:
-    "takes processed PDF dictionary and returns OCR & text paths concatenated"
-    delim = (linesep + linesep)
-    return delim.join([p["text_path"] + p["ocr_path"] for p in pdf["pages"]])
+def inspect_file_or_url(resource: Path | datastructures.UploadFile | HttpUrl | str) -> dict:
+    "takes PDF resource, returns {'name', **triage()} of it without extracting anything, or {'name', 'status': 'fail'}"
+    resource_temporary = not isinstance(resource, Path)
+    file_obj, basename = file_details(resource)
+    if file_obj is None:
+        if isinstance(resource, datastructures.UploadFile):
+            resource = resource.filename
+        logging.error(f'failed to locate FileOrURL "{resource}"')
+        return {"name": str(resource), "status": "fail"}
+    try:
+        return {"name": basename, **triage(file_obj)}
+    finally:
+        _release_file(file_obj, resource_temporary)
+
+
+# -----------------------------------------------------------------------------
+def route_page(stats: dict) -> tuple[str, str]:
+    "takes page_stats() dict, decides whether page needs OCR, returns route ('text' or 'ocr') and reason"
+    if "triage" in stats:  # text path skipped, see triage()
+        if stats["triage"] == "blank":
+            return "text", "triage: blank page, no text or images"
+        return "ocr", "triage: image-only page"
+    if "error" in stats:
+        return "ocr", f"text path failed: {stats['error']}"
+    if stats["count_char"] < ROUTE_MIN_CHARS:
+        if stats["image_coverage"] is None:  # text backend can't tell
+            return "ocr", f"{stats['count_char']} chars"
+        if stats["image_coverage"] > 0:
+            return "ocr", f"{stats['count_char']} chars, image coverage {stats['image_coverage']:.2f}"
+        return "text", "blank page, no text or images"
+    if (
+        stats["image_coverage"] is not None
+        and stats["image_coverage"] >= ROUTE_IMAGE_COVERAGE
+        and stats["text_coverage"] < ROUTE_TEXT_COVERAGE
+    ):
+        return "ocr", (
+            f"image coverage {stats['image_coverage']:.2f}"
+            f" with text coverage {stats['text_coverage']:.2f}"
+        )
+    return "text", f"text layer with {stats['count_char']} chars"
+
+
+# -----------------------------------------------------------------------------
+def format_page_ranges(page_inds: list[int]) -> str:
+    "takes sorted 1-based page numbers, returns them in OCRmyPDF --pages syntax, e.g.; '1-3,7'"
+    ranges = []
+    for page_ind in page_inds:
+        if ranges and ranges[-1][1] == page_ind - 1:
+            ranges[-1][1] = page_ind
+        else:
+            ranges.append([page_ind, page_ind])
+    return ",".join(str(s) if s == e else f"{s}-{e}" for s, e in ranges)
+
+
+# -----------------------------------------------------------------------------
+def get_page_text(page_layout: LTPage) -> str:
+    "takes pdfminer page layout, returns text of its text containers, each surrounded by line separators"
+    return "".join(
+        linesep + element.get_text().strip() + linesep
+        for element in page_layout
+        if isinstance(element, LTTextContainer)
+    )
+
+
+# -----------------------------------------------------------------------------
+def _iter_chars(element) -> Iterator:
+    "takes pdfminer layout element analysed without LAParams, yields its LTChar objects in content stream order"
+    for child in element:
+        if isinstance(child, LTChar):
+            yield child
+        elif isinstance(child, LTFigure):
+            yield from _iter_chars(child)
+
+
+# -----------------------------------------------------------------------------
+def get_page_raw_text(page_layout: LTPage) -> tuple[str, float]:
+    """
+    takes pdfminer page layout analysed without LAParams, returns its chars joined into lines in content stream
+    order, and the summed area of those lines. Much cheaper than grouping chars into boxes, but columns and
+    tables come out in whatever order the PDF draws them
+    """
+    lines = []
+    line = []
+    text_area = 0.0
+    prev = None
+    for char in _iter_chars(page_layout):
+        size = max(char.width, char.height) or 1.0
+        if prev is not None and (abs(char.y0 - prev.y0) > size / 2 or char.x0 < prev.x0 - size):
+            lines.append("".join(line).strip())
+            text_area += (x1 - x0) * (y1 - y0)
+            line = []
+            prev = None
+        if prev is None:
+            x0, y0, x1, y1 = char.x0, char.y0, char.x1, char.y1
+        elif char.x0 - prev.x1 > RAW_TEXT_SPACE * size and line[-1] != " ":
+            line.append(" ")
+        line.append(char.get_text())
+        x0, y0, x1, y1 = min(x0, char.x0), min(y0, char.y0), max(x1, char.x1), max(y1, char.y1)
+        prev = char
+    if line:
+        lines.append("".join(line).strip())
+        text_area += (x1 - x0) * (y1 - y0)
+    return "".join(linesep + l + linesep for l in lines if l), text_area
+
+
+# -----------------------------------------------------------------------------
+def _layout_page(interpreter: PDFPageInterpreter, device: PDFPageAggregator, page: PDFPage
+                 ) -> tuple[str, dict]:
+    "takes PDFminer page, returns its (text str, page_stats()). On error, blank text and the error in stats"
+    try:
+        interpreter.process_page(page)
+        page_layout = device.get_result()
+        if device.laparams is None:
+            page_text, text_area = get_page_raw_text(page_layout)
+            image_area = sum(_image_area(element) for element in page_layout)
+            return page_text, _fast_page_stats(
+                page_text, page_layout.width * page_layout.height, text_area, image_area
+            )
+        page_text = get_page_text(page_layout)
+        return page_text, page_stats(page_layout, page_text)
+    except Exception as e:  # TODO: investig8 specific PDFminer exceptions
+        logging.error(f"PDFminer oops on page: {e}")
+        return "", {"count_char": 0, "text_coverage": 0.0,
+                    "image_coverage": 0.0, "error": str(e)}
+
+
+# -----------------------------------------------------------------------------
+def _pdfminer_interpreter(profile: str = "pdfminer") -> tuple[PDFPageInterpreter, PDFPageAggregator]:
+    "takes one of PDFMINER_PROFILES, returns an interpreter and the device it lays pages out on"
+    resource_manager = PDFResourceManager(caching=True)
+    laparams = PDFMINER_PROFILES[profile]
+    device = PDFPageAggregator(
+        resource_manager, laparams=None if laparams is None else LAParams(**laparams)
+    )
+    return PDFPageInterpreter(resource_manager, device), device
+
+
+# -----------------------------------------------------------------------------
+def _iter_pdfminer(file_obj: Path | IOBase, first_page: int, last_page: int | None,
+                   profile: str = "pdfminer") -> Iterator[tuple[str, dict]]:
+    "PDFminer text backends: pure Python, with as much layout analysis as profile asks for, see PDFMINER_PROFILES"
+    with open_filename(file_obj, "rb") as fp:
+        interpreter, device = _pdfminer_interpreter(profile)
+        for page_ind, page in enumerate(PDFPage.create_pages(PDFDocument(PDFParser(fp))), 1):
+            if page_ind < first_page:
+                continue
+            if last_page is not None and page_ind > last_page:
+                break
+            yield _layout_page(interpreter, device, page)
+
+
+# -----------------------------------------------------------------------------
+def _pdfminer_on_demand(file_obj: Path | IOBase) -> Generator[tuple[str, dict] | None, int, None]:
+    "generator, send() it increasing 1-based page numbers, it answers with PDFminer's (text str, page_stats()), or None"
+    with open_filename(file_obj, "rb") as fp:
+        interpreter, device = _pdfminer_interpreter()
+        pages = enumerate(PDFPage.create_pages(PDFDocument(PDFParser(fp))), 1)
+        result = None
+        while True:
+            wanted = yield result
+            result = None
+            for page_ind, page in pages:  # skipped pages are never laid out
+                if page_ind == wanted:
+                    result = _layout_page(interpreter, device, page)
+                    break
+
+
+# -----------------------------------------------------------------------------
+def _rect_area(left: float, bottom: float, right: float, top: float) -> float:
+    return abs(right - left) * abs(top - bottom)
+
+
+# -----------------------------------------------------------------------------
+def _fast_page_stats(page_text: str, page_area: float, text_area: float | None,
+                     image_area: float | None) -> dict:
+    "like page_stats(), for text backends that report areas themselves (or None if they can't)"
+    return {
+        "count_char": len("".join(page_text.split())),
+        "text_coverage": min(text_area / page_area, 1.0) if page_area and text_area is not None else None,
+        "image_coverage": min(image_area / page_area, 1.0) if page_area and image_area is not None else None,
+    }
+
+
+# -----------------------------------------------------------------------------
+def _failed_page(backend: str, page_ind: int, error: Exception) -> tuple[str, dict]:
+    "returns the (blank text, stats with the error) a text backend yields for a page it failed on, see route_page()"
+    logging.error(f"{backend} oops on page {page_ind}: {error}")
+    return "", {"count_char": 0, "text_coverage": 0.0, "image_coverage": 0.0, "error": str(error)}
+
+
+# -----------------------------------------------------------------------------
+def _iter_pypdfium2(file_obj: Path | IOBase, first_page: int, last_page: int | None
+                    ) -> Iterator[tuple[str, dict]]:
+    "pypdfium2 text backend: PDFium, native and fast"
+    with _PDFIUM_LOCK:  # PDFium is not thread-safe
+        pdf = pypdfium2.PdfDocument(file_obj)
+        count_page = len(pdf)
+    try:
+        for page_ind in range(first_page, min(last_page or count_page, count_page) + 1):
+            try:
+                with _PDFIUM_LOCK:
+                    page = pdf[page_ind - 1]
+                    textpage = page.get_textpage()
+                    page_text = textpage.get_text_range()
+                    text_area = sum(
+                        _rect_area(*textpage.get_rect(ii)) for ii in range(textpage.count_rects())
+                    )
+                    image_area = 0.0
+                    for obj in page.get_objects(filter=(pypdfium2.raw.FPDF_PAGEOBJ_IMAGE,)):
+                        bounds = obj.get_bounds() if hasattr(obj, "get_bounds") else obj.get_pos()
+                        image_area += _rect_area(*bounds)
+                    width, height = page.get_size()
+                    textpage.close()
+                    page.close()
+                result = page_text, _fast_page_stats(page_text, width * height, text_area, image_area)
+            except Exception as e:
+                result = _failed_page("pypdfium2", page_ind, e)
+            yield result
+    finally:
+        with _PDFIUM_LOCK:
+            pdf.close()
+
+
+# -----------------------------------------------------------------------------
+def _iter_pymupdf(file_obj: Path | IOBase, first_page: int, last_page: int | None
+                  ) -> Iterator[tuple[str, dict]]:
+    "PyMuPDF text backend: MuPDF, native and fast"
+    if isinstance(file_obj, IOBase):
+        pdf = pymupdf.open(stream=file_obj.read(), filetype="pdf")
+    else:
+        pdf = pymupdf.open(file_obj)
+    try:
+        for page_ind in range(first_page, min(last_page or len(pdf), len(pdf)) + 1):
+            try:
+                page = pdf[page_ind - 1]
+                page_text = page.get_text("text")
+                text_area = sum(
+                    _rect_area(*b[:4]) for b in page.get_text("blocks") if b[6] == 0
+                )
+                image_area = sum(_rect_area(*i["bbox"]) for i in page.get_image_info())
+                result = page_text, _fast_page_stats(
+                    page_text, page.rect.width * page.rect.height, text_area, image_area
+                )
+            except Exception as e:
+                result = _failed_page("PyMuPDF", page_ind, e)
+            yield result
+    finally:
+        pdf.close()
+
+
+# -----------------------------------------------------------------------------
+def _iter_poppler(file_obj: Path | IOBase, first_page: int, last_page: int | None
+                  ) -> Iterator[tuple[str, dict]]:
+    "Poppler (pdftotext module) text backend: native and fast, but reports no text or image areas"
+    with open_filename(file_obj, "rb") as fp:
+        pdf = pdftotext.PDF(fp)
+        for page_ind in range(first_page, min(last_page or len(pdf), len(pdf)) + 1):
+            try:
+                page_text = pdf[page_ind - 1]
+                result = page_text, _fast_page_stats(page_text, 0.0, None, None)
+            except Exception as e:
+                result = _failed_page("Poppler", page_ind, e)
+            yield result
+
+
+# -----------------------------------------------------------------------------
+def text_looks_wrong(page_text: str) -> bool:
+    "takes page text from a fast text backend, returns True if it looks like a broken font mapping"
+    count_bad = sum(
+        1 for c in page_text
+        if c == "\ufffd" or (category(c) in ("Cc", "Co", "Cs") and c not in "\t\n\r\f")
+    )
+    return count_bad > TEXT_BAD_CHARS_RATIO * len(page_text)
+
+
+# -----------------------------------------------------------------------------
+def _iter_auto(file_obj: Path | IOBase, first_page: int, last_page: int | None
+               ) -> Iterator[tuple[str, dict]]:
+    """
+    uses the first available fast text backend, and PDFminer for pages where its text looks wrong,
+    or that have too little text to tell if they need OCR without PDFminer's image coverage
+    """
+    fast = next((b for b in FAST_TEXT_BACKENDS if b in available_text_backends()), None)
+    if fast is None:
+        yield from _iter_pdfminer(file_obj, first_page, last_page)
+        return
+    pdfminer_pages = None
+    for page_ind, (page_text, stats) in enumerate(
+        TEXT_BACKENDS[fast](file_obj, first_page, last_page), first_page
+    ):
+        if stats["count_char"] < ROUTE_MIN_CHARS or text_looks_wrong(page_text):
+            if pdfminer_pages is None:
+                pdfminer_pages = _pdfminer_on_demand(file_obj)
+                next(pdfminer_pages)
+            fallback = pdfminer_pages.send(page_ind)
+            if fallback is not None:
+                page_text, stats = fallback
+        yield page_text, stats
+    if pdfminer_pages is not None:
+        pdfminer_pages.close()
+
+
+# -----------------------------------------------------------------------------
+def available_text_backends() -> list[str]:
+    "returns names of text backends whose modules are installed"
+    missing = {"pypdfium2": pypdfium2, "pymupdf": pymupdf, "poppler": pdftotext}
+    return [b for b in TEXT_BACKENDS if missing.get(b, True) is not None]
+
+
+# -----------------------------------------------------------------------------
+def iter_text_path(
+    file_obj: Path | IOBase,
+    progress: Callable | None = None,
+    first_page: int = 1,
+    last_page: int | None = None,
+    max_pages: int | None = None,
+    text_backend: str | None = None,
+) -> Iterator[tuple[str, dict]]:
+    """
+    takes PDF resource, yields (text str, page_stats()) of each page as soon as text_backend has read it, so only
+    one page is held in memory. Pages are 1-based, from first_page up to last_page, at most max_pages of them.
+    A page the backend fails on is yielded as blank, with the error in its stats, and the next page is tried.
+    calls progress("text", pages_done, None) after each page, if given
+    """
+    # TODO: tables ( PDFplumber), images, annotations
+    if text_backend is None:
+        text_backend = TEXT_BACKEND
+    if text_backend not in available_text_backends():
+        logging.error(f'text backend "{text_backend}" is not installed, using pdfminer')
+        text_backend = "pdfminer"
+    if max_pages is not None:
+        max_last_page = first_page + max_pages - 1
+        last_page = max_last_page if last_page is None else min(last_page, max_last_page)
+    elapsed = 0.0  # not counting time spent by the consumer between pages
+    try:
+        pages = TEXT_BACKENDS[text_backend](file_obj, first_page, last_page)
+        count_done = 0
+        while True:
+            start = monotonic()
+            page = next(pages, None)
+            elapsed += monotonic() - start
+            if page is None:
+                break
+            count_done += 1
+            if progress is not None:
+                progress("text", count_done, None)
+            yield page
+    except Exception as e:  # TODO: investig8 specific PDFminer exceptions
+        logging.error(f"{text_backend} oops: {e}")
+    finally:
+        observe_stage("text_path", elapsed, backend=text_backend)
+
+
+TEXT_BACKENDS = {
+    "pdfminer": _iter_pdfminer,
+    "pdfminer_tuned": partial(_iter_pdfminer, profile="pdfminer_tuned"),
+    "pdfminer_fast": partial(_iter_pdfminer, profile="pdfminer_fast"),
+    "pypdfium2": _iter_pypdfium2,
+    "pymupdf": _iter_pymupdf,
+    "poppler": _iter_poppler,
+    "auto": _iter_auto,
+}
+
+
+# -----------------------------------------------------------------------------
+def process_text_path_stats(
+    file_obj: Path | IOBase, progress: Callable | None = None
+) -> tuple[list[str], list[dict]]:
+    "takes PDF resource, processes pages containing text, returns list of text str in pages and list of page_stats()"
+    pdf_text = []
+    pdf_stats = []
+    for page_text, stats in iter_text_path(file_obj, progress):
+        pdf_text.append(page_text)
+        pdf_stats.append(stats)
+    return pdf_text, pdf_stats
+
+
+# -----------------------------------------------------------------------------
+def process_text_path(file_obj: Path | IOBase) -> list[str] | None:
+    "takes PDF resource, processes pages containing text, returns list of text str in pages"
+    return process_text_path_stats(file_obj)[0]
+
+
+# -----------------------------------------------------------------------------
+_OCR_GATE = None  # in batch child processes: Connection to ask the parent for an OCR slot, and OCR pool pages
+
+
+@contextmanager
+def _ocr_slot():
+    "blocks until the batch parent (if any) grants an OCR slot, releases it on exit"
+    if _OCR_GATE is None:
+        yield
+        return
+    _OCR_GATE.send(("ocr", None))
+    _OCR_GATE.recv()  # grant
+    try:
+        yield
+    finally:
+        _OCR_GATE.send(("ocr_done", None))
+
+
+# -----------------------------------------------------------------------------
+def _tesseract_langs() -> set[str]:
+    "returns the languages Tesseract has models for (including 'osd', needed to detect page rotation), empty if unknown"
+    global _TESSERACT_LANGS
+    if _TESSERACT_LANGS is None:
+        try:
+            proc = subprocess.run(["tesseract", "--list-langs"], capture_output=True, timeout=30, check=True)
+            _TESSERACT_LANGS = {l.strip() for l in proc.stdout.decode("utf-8").splitlines()[1:]}
+        except (OSError, subprocess.SubprocessError):
+            _TESSERACT_LANGS = set()
+    return _TESSERACT_LANGS
+
+
+# -----------------------------------------------------------------------------
+def ocr_plan(page: dict | None) -> dict | None:
+    """
+    takes _triage_page() dict of a page routed to OCR (None if unknown), returns how to preprocess it: dict with
+    OCR resolution 'dpi', 'max_pixels' on the longest side to downsample to (None if not needed), 'deskew' and
+    'rotate', and the 'image_dpi' it was scanned at. Returns None if its image is over OCR_MAX_MPIXELS and it shouldn't be OCR'd
+    """
+    plan = {"dpi": OCR_DPI, "max_pixels": None, "deskew": True, "rotate": False, "image_dpi": None}
+    if page is None or page["kind"] == "corrupt":
+        return plan
+    if page["image_mpixels"] > OCR_MAX_MPIXELS:
+        return None
+    if page["kind"] != "image":  # born-digital pages with broken text, or with images on them aren't skewed
+        plan["deskew"] = False
+        return plan
+    # scans: OCR at the scanned resolution, within limits, and only fix skew and rotation when it's affordable
+    image_dpi = page["image_dpi"] or OCR_DPI
+    plan["image_dpi"] = page["image_dpi"]
+    plan["dpi"] = max(image_dpi, OCR_MIN_DPI)
+    if OCR_MAX_DPI and image_dpi > OCR_MAX_DPI:
+        plan["dpi"] = OCR_MAX_DPI
+        width_in, height_in = page["size_in"]
+        plan["max_pixels"] = round(max(width_in, height_in) * OCR_MAX_DPI)
+    plan["deskew"] = page["image_mpixels"] <= OCR_DESKEW_MAX_MPIXELS
+    plan["rotate"] = "osd" in _tesseract_langs()
+    return plan
+
+
+# -----------------------------------------------------------------------------
+def ocr_plans(file_obj: Path | IOBase, pages: list[int]) -> dict[int, dict | None]:
+    "takes PDF resource and pages (1-based) routed to OCR, returns ocr_plan() of each, from a pikepdf scan of them"
+    try:
+        with pikepdf.open(file_obj) as pdf:
+            found = {
+                page_ind: _triage_page(pdf.pages[page_ind - 1], page_ind)
+                for page_ind in pages
+                if page_ind <= len(pdf.pages)
+            }
+    except (pikepdf.PdfError, OSError) as e:
+        logging.error(f"can't plan OCR preprocessing, using defaults: {e}")
+        found = {}
+    finally:
+        if isinstance(file_obj, IOBase):
+            file_obj.seek(0)
+    return {page_ind: ocr_plan(found.get(page_ind)) for page_ind in pages}
+
+
+# -----------------------------------------------------------------------------
+def _ocrmypdf_options(plan: dict) -> dict:
+    "takes ocr_plan(), returns the OCRmyPDF options that carry it out"
+    return {
+        "deskew": plan["deskew"],
+        "rotate_pages": plan["rotate"],
+        "oversample": plan["dpi"] if plan["image_dpi"] and plan["dpi"] > plan["image_dpi"] else None,
+        # Tesseract plugin options, which OCRmyPDF 16 has, unlike max_ocr_image_mpixels (17+)
+        "tesseract_downsample_large_images": True if plan["max_pixels"] else None,
+        "tesseract_downsample_above": plan["max_pixels"],
+        "max_image_mpixels": OCR_MAX_MPIXELS,
+    }
+
+
+# -----------------------------------------------------------------------------
+def _run_ocrmypdf(file_obj: Path | IOBase, languages: str, tesseract_timeout: int,
+                  pages: list[int] | None, jobs: int | None, plan: dict | None = None) -> list[str]:
+    """
+    runs OCRmyPDF on pages (1-based, None means all without text) of file_obj, preprocessed as ocr_plan() says,
+    returns list of text in pages
+    """
+    with NamedTemporaryFile(prefix=_SCRIPT_NAME_, suffix=".txt") as tmp_file:
+        ocrmypdf.ocr(
+            file_obj,
+            path.devnull,
+            continue_on_soft_render_error=True,
+            **_ocrmypdf_options(plan or ocr_plan(None)),
+            language=languages,
+            output_type="none",
+            progress_bar=False,
+            sidecar=tmp_file.name,
+            # routed pages were already judged to lack a usable text layer
+            skip_text=pages is None,
+            force_ocr=pages is not None,
+            pages=format_page_ranges(pages) if pages is not None else None,
+            tesseract_timeout=tesseract_timeout,
+            jobs=jobs,
+        )
+        with open(tmp_file.name, "rb") as rfp:
+            text = str(rfp.read(), "utf-8")
+    return insert_skipped_pages([p.strip() for p in text.split("\f")])
+
+
+# -----------------------------------------------------------------------------
+def _child_context():
+    """
+    returns the multiprocessing context of batch, sandbox and OCR chunk children: forked from a server process that
+    imported this module, since forking a threaded web server isn't safe
+    """
+    global _CHILD_CONTEXT
+    if _CHILD_CONTEXT is None:
+        _CHILD_CONTEXT = get_context("forkserver")
+        _CHILD_CONTEXT.set_forkserver_preload(["__main__", __name__])  # imported once, not per child
+    return _CHILD_CONTEXT
+
+
+# -----------------------------------------------------------------------------
+def _child_settings() -> tuple[dict, str]:
+    "returns CHILD_SETTINGS and the LOGLEVELS value logging is set up with, for _apply_settings() in a child"
+    if logging.root.manager.disable >= logging.CRITICAL:
+        log_level = "QUIET"
+    else:
+        log_level = "INFO" if logging.root.level <= logging.INFO else "ERROR"
+    return {key: globals()[key] for key in CHILD_SETTINGS}, log_level
+
+
+# -----------------------------------------------------------------------------
+def _apply_settings(settings: dict, log_level: str):
+    "runs in _child_context() children: takes the parent's _child_settings(), sets them up here"
+    globals().update(settings)
+    set_up_logging(log_level, "STDERR")
+
+
+# -----------------------------------------------------------------------------
+def _ocr_chunk_child(conn, file_obj: Path | str, languages: str, tesseract_timeout: int,
+                     pages: list[int], jobs: int, plan: dict, settings: dict, log_level: str):
+    """
+    runs in OCR chunk child process: OCRs pages, sends ('ok', list of text) or ('error', (exception type, message))
+    back through conn
+    """
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()  # so a timeout also kills Tesseract / Ghostscript children
+    _apply_settings(settings, log_level)
+    try:
+        conn.send(("ok", _run_ocrmypdf(file_obj, languages, tesseract_timeout, pages, jobs, plan)))
+    except Exception as e:
+        conn.send(("error", (type(e).__name__, f"{type(e).__name__}: {e}")))
+    conn.close()
+
+
+# -----------------------------------------------------------------------------
+def _pages_label(pages: list[int]) -> str:
+    "returns e.g.; 'page 3' or 'pages 1-2,5' for log messages"
+    return f"page{'s' if len(pages) > 1 else ''} {format_page_ranges(pages)}"
+
+
+# -----------------------------------------------------------------------------
+def _run_ocr_chunks(file_obj: Path | str, languages: str, tesseract_timeout: int, chunks: list[list[int]],
+                    jobs: int, plans: dict[int, dict]) -> list[list[str] | tuple[str, str]]:
+    """
+    takes local PDF file and lists of pages sharing an ocr_plan() (plans maps pages to them), OCRs each list in its
+    own child process, OCR_PAGE_WORKERS at a time, killing any that runs over OCR_PAGE_TIMEOUT seconds per page.
+    returns, for each chunk, list of text in pages or (kind of error, error message)
+    """
+    context = _child_context()
+    settings, log_level = _child_settings()
+    results = [None] * len(chunks)
+    pending = list(enumerate(chunks))
+    running = {}  # Connection -> [index, Process, deadline]
+    while pending or running:
+        while pending and len(running) < max(1, OCR_PAGE_WORKERS):
+            index, chunk = pending.pop(0)
+            parent_conn, child_conn = context.Pipe()
+            proc = context.Process(
+                target=_ocr_chunk_child,
+                args=(child_conn, file_obj, languages, tesseract_timeout, chunk, jobs, plans[chunk[0]], settings,
+                      log_level),
+            )
+            proc.start()
+            child_conn.close()
+            deadline = monotonic() + OCR_PAGE_TIMEOUT * len(chunk) if OCR_PAGE_TIMEOUT else float("inf")
+            running[parent_conn] = [index, proc, deadline]
+
+        deadline = min(r[2] for r in running.values())
+        for conn in wait(list(running), None if deadline == float("inf") else max(0, deadline - monotonic())):
+            index, proc, _ = running.pop(conn)
+            try:
+                status, payload = conn.recv()
+            except (EOFError, OSError):  # child died without a result
+                status, payload = "error", ("crash", "crashed")
+            conn.close()
+            proc.join()
+            if status == "ok":
+                results[index] = payload
+            else:
+                results[index] = (payload[0], f"{_pages_label(chunks[index])}: {payload[1]}")
+
+        now = monotonic()
+        for conn in [c for c, r in running.items() if r[2] <= now]:
+            index, proc, _ = running.pop(conn)
+            _kill_process_group(proc)
+            conn.close()
+            results[index] = ("timeout", f"{_pages_label(chunks[index])}: timed out")
+    return results
+
+
+# -----------------------------------------------------------------------------
+def _split_pages(pages: list[int], count_chunk: int) -> list[list[int]]:
+    "takes sorted pages, returns them split into at most count_chunk runs of about the same length, in order"
+    count_chunk = max(1, min(count_chunk, len(pages)))
+    size, extra = divmod(len(pages), count_chunk)
+    chunks = []
+    start = 0
+    for ii in range(count_chunk):
+        end = start + size + (ii < extra)
+        chunks.append(pages[start:end])
+        start = end
+    return chunks
+
+
+# -----------------------------------------------------------------------------
+def process_ocr_path(file_obj: Path | IOBase, languages: str, tesseract_timeout: int,
+                     pages: list[int] | None = None) -> list[str] | None:
+    # TODO: supporting GPUs? see https://github.com/ocrmypdf/OCRmyPDF/issues/221
+    # TODO: look into options --remove-background, --clean, --invalidate-digital-signatures, --rotate-pages-threshold, all --tesseract* (see ocrmypdf --help)
+    """
+    takes PDF resource, processes OCR pages, returns list of text in pages, or None if OCR failed on all of them.
+    if pages (1-based) is given, only those are OCR'd, even if they have some text; the rest come back blank.
+    each page is preprocessed as its ocr_plan() says, pages with the same plan are OCR'd together.
+    they are OCR'd in up to OCR_PAGE_WORKERS chunks at the same time, and pages of a chunk that fails are retried
+    one by one, so a page OCRmyPDF can't handle comes back blank without losing the text of the others.
+    chunks run in child processes, so OCR_PAGE_TIMEOUT holds, unless it's None and there's only one chunk
+    """
+    if OCR_ENGINE == "tesseract":
+        if "tesseract" in available_ocr_engines():
+            return process_tesseract_path(file_obj, languages, tesseract_timeout, pages)
+        logging.error('OCR engine "tesseract" needs pypdfium2 installed, using ocrmypdf')
+
+    with _ocr_slot(), timed_stage("ocr_path", engine="ocrmypdf"):
+        if pages is None:  # the text path couldn't read the PDF, so neither is planning likely to
+            chunks, plans = [None], {}
+        else:
+            plans = ocr_plans(file_obj, pages)
+            for page_ind in [p for p in pages if plans[p] is None]:
+                logging.error(f"page {page_ind} not OCR'd, it has an image over {OCR_MAX_MPIXELS} megapixels")
+                add_metric("ocr_failures_total")
+            groups = {}  # pages with the same plan, in order
+            for page_ind in pages:
+                if plans[page_ind] is not None:
+                    groups.setdefault(json.dumps(plans[page_ind], sort_keys=True), []).append(page_ind)
+            chunks = list(groups.values())
+        # a timeout needs a child process, which needs pages (for its length) and a file it can open
+        if pages is None or isinstance(file_obj, IOBase) or (
+            not OCR_PAGE_TIMEOUT and (OCR_PAGE_WORKERS <= 1 or len(pages) == 1)
+        ):
+            results = []
+            for chunk in chunks:
+                try:
+                    results.append(_run_ocrmypdf(
+                        file_obj, languages, tesseract_timeout, chunk, OCR_JOBS, plans.get(chunk and chunk[0])
+                    ))
+                except Exception as e:
+                    # TODO: some exceptions may be recoverable or have a "workaround"; not
+                    # necessarily result in "fail"
+                    results.append((type(e).__name__, f"{type(e).__name__}: {e}"))
+        else:
+            chunks = [c for group in chunks for c in _split_pages(group, max(1, OCR_PAGE_WORKERS // len(chunks)))]
+            # split cores between the chunks, so OCRmyPDF doesn't oversubscribe them
+            jobs = max(1, (OCR_JOBS or cpu_count() or 1) // max(1, min(len(chunks), OCR_PAGE_WORKERS)))
+            results = _run_ocr_chunks(file_obj, languages, tesseract_timeout, chunks, jobs, plans)
+
+        for _ in range(OCR_RETRIES):
+            retry = [
+                ii for ii, (chunk, result) in enumerate(zip(chunks, results))
+                if isinstance(result, tuple) and chunk is not None and result[0] not in OCR_FATAL_ERRORS
+            ]
+            if not retry:
+                break
+            for ii in retry:
+                logging.error(f"OCRmyPDF oops: {results[ii][1]}, retrying its pages one by one")
+            single = [[page_ind] for ii in retry for page_ind in chunks[ii]]
+            chunks = [c for ii, c in enumerate(chunks) if ii not in retry] + single
+            results = [r for ii, r in enumerate(results) if ii not in retry] + _run_ocr_chunks(
+                file_obj, languages, tesseract_timeout, single, 1, plans
+            )
+
+    text = [""] * (max(pages) if pages else 0)
+    count_ok = 0
+    for chunk, result in zip(chunks, results):
+        if isinstance(result, tuple):
+            logging.error(f"OCRmyPDF oops: {result[1]}")
+            add_metric("ocr_failures_total")
+            continue
+        count_ok += 1
+        if chunk is None:
+            return result
+        for page_ind in chunk:
+            if len(result) >= page_ind:
+                text[page_ind - 1] = result[page_ind - 1]
+    return text if count_ok else None
+
+
+# -----------------------------------------------------------------------------
+def insert_skipped_pages(pages: list) -> list:
+    "replaces OCRmyPDF compressed skip pages output with blank pages in list"
+    _pages = []
+    for page in pages:
+        if len(page) < 100:    # otherwise too long to be page skip text
+            matched = search(OCR_SKIP_PAGES_RE, _split(r"[\r\n]+", page, maxsplit=1)[0])
+            if matched:
+                _range = matched.group(1).split("-")
+                start = int(_range[0])
+                end = int(_range[1]) if len(_range) > 1 else start
+                count_skip_page = end - start + 1
+                _pages.extend([""] * count_skip_page)
+                continue
+        _pages.append(page)
+    return _pages
+
+
+# -----------------------------------------------------------------------------
+def available_ocr_engines() -> list[str]:
+    "returns names of OCR engines whose modules are installed"
+    return [e for e in OCR_ENGINES if e != "tesseract" or pypdfium2 is not None]
+
+
+# -----------------------------------------------------------------------------
+def _tesseract_page(apis: dict, pdf_path: str, page_ind: int, languages: str, tesseract_timeout: int,
+                    dpi: int = OCR_DPI) -> str:
+    "runs in OCR pool process: rasterizes page page_ind (1-based) of pdf_path at dpi, returns its Tesseract text"
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    try:
+        page = pdf[page_ind - 1]
+        image = page.render(scale=dpi / 72, grayscale=True).to_pil()
+        page.close()
+    finally:
+        pdf.close()
+    if tesserocr is not None:
+        if languages not in apis:  # loading the models is the slow part, keep them for the next page
+            apis[languages] = tesserocr.PyTessBaseAPI(lang=languages)
+        apis[languages].SetImage(image)
+        return apis[languages].GetUTF8Text()
+    image_file = BytesIO()
+    image.save(image_file, "PNG", dpi=(dpi, dpi))
+    proc = subprocess.run(
+        ["tesseract", "stdin", "stdout", "-l", languages],
+        input=image_file.getvalue(), capture_output=True, timeout=tesseract_timeout, check=True,
+    )
+    return proc.stdout.decode("utf-8")
+
+
+# -----------------------------------------------------------------------------
+def _ocr_pool_worker(conn):
+    "runs in OCR pool process: OCRs (pdf_path, page_ind, languages, timeout, dpi) tasks from conn until it's closed"
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()  # so a timeout also kills a Tesseract child
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent decides when to stop
+    apis = {}  # languages -> tesserocr API
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            conn.send(("ok", _tesseract_page(apis, *task)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+# -----------------------------------------------------------------------------
+class OCRPool:
+    """
+    long-lived Tesseract worker processes, which keep their language models loaded between pages and documents.
+    A page that takes too long gets its worker killed and replaced
+    """
+
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        self._context = get_context("spawn")  # forking a threaded web server isn't safe
+        self._idle = Queue()
+        for _ in range(self.workers):
+            self._idle.put(self._start())
+
+    def _start(self) -> tuple[Process, Connection]:
+        parent_conn, child_conn = self._context.Pipe()
+        proc = self._context.Process(target=_ocr_pool_worker, args=(child_conn,), daemon=True)
+        proc.start()
+        child_conn.close()
+        return proc, parent_conn
+
+    def ocr_page(self, pdf_path: Path | str, page_ind: int, languages: str, tesseract_timeout: int,
+                 dpi: int = OCR_DPI) -> str:
+        "returns Tesseract text of page page_ind (1-based) rasterized at dpi, raises RuntimeError if it fails or takes too long"
+        proc, conn = self._idle.get()
+        try:
+            conn.send((str(pdf_path), page_ind, languages, tesseract_timeout, dpi))
+            if not conn.poll(tesseract_timeout):
+                raise TimeoutError(f"page {page_ind} took over {tesseract_timeout}s")
+            status, payload = conn.recv()
+        except (EOFError, OSError) as e:  # worker died, or timed out
+            _kill_process_group(proc)
+            conn.close()
+            proc, conn = self._start()
+            raise RuntimeError(f"OCR worker failed on page {page_ind}: {e or 'crashed'}") from e
+        finally:
+            self._idle.put((proc, conn))
+        if status != "ok":
+            raise RuntimeError(f"Tesseract failed on page {page_ind}: {payload}")
+        return payload
+
+
+# -----------------------------------------------------------------------------
+class GateOCRPool:
+    """
+    stands in for OCRPool in batch child processes: sends pages through _OCR_GATE to the batch parent, which OCRs
+    them on its one warm OCRPool. Replies may come back in any order, so any thread waiting for one reads the next
+    """
+
+    def __init__(self, conn: Connection):
+        self._conn = conn
+        self._send_lock = Lock()
+        self._recv_lock = Lock()
+        self._next_id = 0
+        self._replies = {}  # task id -> (status, payload) read by another thread
+
+    def ocr_page(self, pdf_path: Path | str, page_ind: int, languages: str, tesseract_timeout: int,
+                 dpi: int = OCR_DPI) -> str:
+        "like OCRPool.ocr_page"
+        with self._send_lock:
+            self._next_id += 1
+            task_id = self._next_id
+            self._conn.send(("ocr_page", (task_id, (str(pdf_path), page_ind, languages, tesseract_timeout, dpi))))
+        while True:
+            with self._recv_lock:
+                if task_id not in self._replies:
+                    _, (reply_id, status, payload) = self._conn.recv()
+                    self._replies[reply_id] = (status, payload)
+                if task_id in self._replies:
+                    status, payload = self._replies.pop(task_id)
+                    break
+        if status != "ok":
+            raise RuntimeError(payload)
+        return payload
+
+
+# -----------------------------------------------------------------------------
+def get_ocr_pool() -> OCRPool:
+    "returns the process-wide OCRPool, started on first use with OCR_POOL_SIZE workers"
+    global _OCR_POOL
+    with _OCR_POOL_LOCK:
+        if _OCR_POOL is None:
+            _OCR_POOL = OCRPool(OCR_POOL_SIZE or cpu_count() or 1)
+        return _OCR_POOL
+
+
+# -----------------------------------------------------------------------------
+def process_tesseract_path(file_obj: Path | str, languages: str, tesseract_timeout: int,
+                           pages: list[int] | None = None) -> list[str] | None:
+    """
+    like process_ocr_path, but OCRs pages on the warm OCRPool instead of running OCRmyPDF: no deskew or
+    PDF/A pipeline, and the text comes back in memory. Pages are rasterized at the resolution their ocr_plan()
+    picks. OCR_PAGE_WORKERS pages at a time, each retried OCR_RETRIES times if it fails, then left blank.
+    returns None if all pages fail
+    """
+    if pages is None:
+        try:
+            with _PDFIUM_LOCK:
+                pdf = pypdfium2.PdfDocument(str(file_obj))
+                count_page = len(pdf)
+                pdf.close()
+        except Exception as e:
+            logging.error(f"Tesseract oops: {e}")
+            add_metric("ocr_failures_total")
+            return None
+        pages = list(range(1, count_page + 1))
+    plans = ocr_plans(file_obj, pages)
+    pool = get_ocr_pool()
+
+    def ocr_page(page_ind: int) -> str | None:
+        if plans[page_ind] is None:
+            logging.error(f"page {page_ind} not OCR'd, it has an image over {OCR_MAX_MPIXELS} megapixels")
+            add_metric("ocr_failures_total")
+            return None
+        for attempt in range(OCR_RETRIES + 1):
+            try:
+                return pool.ocr_page(file_obj, page_ind, languages, tesseract_timeout, plans[page_ind]["dpi"]).strip()
+            except Exception as e:
+                logging.error(f"Tesseract oops: {e}{', retrying' if attempt < OCR_RETRIES else ''}")
+        add_metric("ocr_failures_total")
+        return None
+
+    with _ocr_slot(), timed_stage("ocr_path", engine="tesseract"):
+        with ThreadPoolExecutor(max(1, OCR_PAGE_WORKERS)) as executor:
+            results = list(executor.map(ocr_page, pages))
+    if pages and all(r is None for r in results):
+        return None
+    texts = [""] * (max(pages) if pages else 0)
+    for page_ind, text in zip(pages, results):
+        texts[page_ind - 1] = text or ""
+    return texts
+
+
+# -----------------------------------------------------------------------------
+def result_settings(languages: str, tesseract_timeout: int, text_backend: str) -> dict:
+    "returns the settings that change results, for cache keys and sync manifests"
+    return {
+        "languages": languages,
+        "tesseract_timeout": tesseract_timeout,
+        "route": [ROUTE_MIN_CHARS, ROUTE_IMAGE_COVERAGE, ROUTE_TEXT_COVERAGE],
+        "max_pages": MAX_PAGES,
+        "text_backend": text_backend,
+        "ocr_engine": OCR_ENGINE,
+        "triage": TRIAGE,
+        "ocr_dpi": [OCR_MIN_DPI, OCR_MAX_DPI, OCR_MAX_MPIXELS],
+        "ocrmypdf": ocrmypdf.__version__,
+        "pdfminer": pdfminer.__version__,
+    }
+
+
+# -----------------------------------------------------------------------------
+def file_sha256(file_obj: Path | str, extra: bytes = b"") -> str:
+    "returns hex sha256 of local file's content, followed by extra bytes"
+    digest = sha256()
+    with open(file_obj, "rb") as rfp:
+        while chunk := rfp.read(1 << 20):
+            digest.update(chunk)
+    digest.update(extra)
+    return digest.hexdigest()
+
+
+# -----------------------------------------------------------------------------
+def cache_key(
+    file_obj: Path | str, languages: str, tesseract_timeout: int, text_backend: str
+) -> str:
+    "takes local PDF file and settings that change results, returns key to cache results under"
+    settings = result_settings(languages, tesseract_timeout, text_backend)
+    return file_sha256(file_obj, json.dumps(settings, sort_keys=True).encode("utf-8"))
+
+
+# -----------------------------------------------------------------------------
+def _cache_path(key: str) -> Path:
+    return Path(CACHE_DIR, key[:2], f"{key}.json")
+
+
+# -----------------------------------------------------------------------------
+def cache_get(key: str) -> dict | None:
+    "returns result cached under key, or None. A hit counts as a use for eviction"
+    cache_path = _cache_path(key)
+    try:
+        with open(cache_path, "r", encoding="utf-8") as rfp:
+            result = json.load(rfp)
+        cache_path.touch()
+    except (OSError, ValueError):
+        CACHE_STATS["miss"] += 1
+        add_metric("cache_lookups_total", result="miss")
+        return None
+    CACHE_STATS["hit"] += 1
+    add_metric("cache_lookups_total", result="hit")
+    return result
+
+
+# -----------------------------------------------------------------------------
+def cache_put(key: str, result: dict):
+    "stores result under key (atomically, so concurrent readers never see partial files), then evicts"
+    cache_path = _cache_path(key)
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with NamedTemporaryFile(
+            "w", encoding="utf-8", dir=cache_path.parent, suffix=".tmp", delete=False
+        ) as wfp:
+            json.dump(result, wfp)
+        os.replace(wfp.name, cache_path)
+        size = cache_path.stat().st_size
+    except OSError as e:
+        logging.error(f'failed to write cache file "{cache_path}": {e}')
+        return
+    cache_evict(size)
+
+
+# -----------------------------------------------------------------------------
+def cache_evict(added: int = 0):
+    """
+    takes size of a file just cached, removes cached results & downloads unused for CACHE_MAX_AGE days, then least
+    recently used ones over CACHE_MAX_MB. Scanning the cache stats every entry, so it only runs when the last scan
+    (by any process, recorded in evicted.json) is older than CACHE_EVICT_INTERVAL, or its size plus what this process
+    cached since may be over CACHE_MAX_MB
+    """
+    global _CACHE_WRITTEN
+    marker = Path(CACHE_DIR, "evicted.json")
+    with _CACHE_LOCK:
+        _CACHE_WRITTEN += added
+        try:
+            scanned = marker.stat().st_mtime
+            last_size = json.loads(marker.read_text(encoding="utf-8"))["size"]
+        except (OSError, ValueError, KeyError, TypeError):  # never scanned, or written concurrently
+            scanned = None
+        if scanned is not None and 0 <= time() - scanned < CACHE_EVICT_INTERVAL:
+            if last_size + _CACHE_WRITTEN <= CACHE_MAX_MB * (1 << 20):
+                return
+        _cache_scan()
+        _CACHE_WRITTEN = 0
+
+
+# -----------------------------------------------------------------------------
+def _cache_scan():
+    "cache_evict() proper: scans the cache, evicts, records the size left and the time in evicted.json"
+    entries = []
+    for cache_path in [*Path(CACHE_DIR).glob("*/*.json"), *Path(CACHE_DIR).glob("downloads/*.pdf")]:
+        try:
+            st = cache_path.stat()
+        except OSError:  # evicted concurrently
+            continue
+        entries.append((st.st_mtime, st.st_size, cache_path))
+    entries.sort()
+    min_mtime = time() - CACHE_MAX_AGE * 86400
+    total_size = sum(e[1] for e in entries)
+    max_size = CACHE_MAX_MB * (1 << 20)
+    if total_size > max_size:
+        max_size *= 0.9  # headroom, so a full cache isn't rescanned on every write
+    for mtime, size, cache_path in entries:
+        if mtime >= min_mtime and total_size <= max_size:
+            break
+        try:
+            cache_path.unlink()
+            cache_path.with_suffix(".meta").unlink(missing_ok=True)
+        except OSError:
+            pass
+        total_size -= size
+    try:
+        with NamedTemporaryFile("w", encoding="utf-8", dir=CACHE_DIR, suffix=".tmp", delete=False) as wfp:
+            json.dump({"size": total_size}, wfp)
+        os.replace(wfp.name, Path(CACHE_DIR, "evicted.json"))
+    except OSError as e:
+        logging.error(f'failed to write "{Path(CACHE_DIR, "evicted.json")}": {e}')
+
+
+# -----------------------------------------------------------------------------
+def _release_file(file_obj: Path | IOBase | str, resource_temporary: bool):
+    "closes file_obj, and removes it if it's a temporary copy of the resource"
+    if hasattr(file_obj, "close"):
+        file_obj.close()
+    if (isinstance(file_obj, str) or isinstance(file_obj, Path)) and resource_temporary:
+        remove(file_obj)
+
+
+# -----------------------------------------------------------------------------
+def _ocr_pages(
+    file_obj: Path | IOBase, pages: list[dict], languages: str, tesseract_timeout: int
+) -> bool:
+    "takes page dicts, fills in ocr_path of those routed to OCR in one OCRmyPDF run, returns False if OCR failed"
+    ocr_inds = [page["page_ind"] for page in pages if page["route"] == "ocr"]
+    if not ocr_inds:
+        return True
+    pages_ocr_path = process_ocr_path(file_obj, languages, tesseract_timeout, ocr_inds)
+    if pages_ocr_path is None:
+        return False
+    for page in pages:
+        if page["route"] == "ocr" and len(pages_ocr_path) >= page["page_ind"]:
+            page["ocr_path"] = pages_ocr_path[page["page_ind"] - 1]
+    return True
+
+
+# -----------------------------------------------------------------------------
+def iter_file_or_url(
+    resource: Path | datastructures.UploadFile | HttpUrl | str,
+    languages: str | None = None,
+    tesseract_timeout: int | None = None,
+    progress: Callable | None = None,
+    ocr_chunk: int | None = None,
+    text_backend: str | None = None,
+) -> Iterator[dict]:
+    """
+    like process_file_or_url, but yields results as soon as they are ready: first {"name"}, then a dict per page,
+    in page order, then {"name", "count_page", "status"}. If the resource can't be read, only {"name", "status"}.
+    pages routed to OCR are OCR'd ocr_chunk at a time, None means all in one OCRmyPDF run after the text path
+    """
+    if languages is None:
+        languages = LANGUAGES
+    if tesseract_timeout is None:
+        tesseract_timeout = TESSERACT_TIMEOUT
+    if text_backend is None:
+        text_backend = TEXT_BACKEND
+
+    resource_temporary = not isinstance(resource, Path)
+    file_obj, basename = file_details(resource)
+
+    if file_obj is None:
+        if isinstance(resource, datastructures.UploadFile):
+            resource = resource.filename
+        logging.error(f'failed to locate FileOrURL "{resource}"')
+        add_metric("documents_total", status="fail")
+        yield {"name": resource, "status": "fail"}
+        return
+
+    try:
+        yield {"name": basename}
+
+        key = None
+        if CACHE_DIR is not None:
+            key = cache_key(file_obj, languages, tesseract_timeout, text_backend)
+            cached = cache_get(key)
+            if cached is not None:
+                logging.info(f'"{basename}": using cached result')
+                add_metric("documents_total", status=cached["status"])
+                yield from cached["pages"]
+                yield {"name": basename, "count_page": cached["count_page"],
+                       "status": cached["status"]}
+                return
+
+        scan = triage(file_obj) if TRIAGE or FILE_MAX_PAGES or FILE_MAX_MPIXELS else None
+        if scan is not None and scan["status"] != "ok":
+            logging.error(f'"{basename}": rejected by triage as {scan["status"]}: {scan["error"]}')
+            add_metric("documents_total", status="rejected")
+            yield failure_result(basename, scan["status"], f"{scan['status']}: {scan['error']}")
+            return
+        over = None if scan is None else check_limits(scan)
+        if over is not None:
+            kind, error, limit, value = over
+            logging.error(f'"{basename}": refused, {error}')
+            add_metric("documents_total", status="rejected")
+            yield failure_result(basename, kind, error, limit=limit, value=value)
+            return
+        if not TRIAGE:  # only scanned for the limits
+            scan = None
+
+        pages = []  # kept only to be cached
+        waiting = []  # pages not yielded yet, because they or pages before them wait for OCR
+        count_page = count_ocr = count_ocr_done = 0
+        ocr_failed = False
+        if scan is not None and scan["route"] == "ocr":  # scanned, nothing for the text path to find
+            logging.info(f'"{basename}": triage found only images, skipping the text path')
+            text_pages = (("", {"triage": p["kind"]}) for p in scan["pages"])
+        else:
+            text_pages = iter_text_path(
+                file_obj, progress, max_pages=MAX_PAGES, text_backend=text_backend
+            )
+        for page_ind, (page_text, stats) in enumerate(text_pages, 1):  # 1-based counting  :-D
+            count_page = page_ind
+            route, route_reason = route_page(stats)
+            waiting.append({"page_ind": page_ind, "text_path": page_text,
+                            "ocr_path": "", "route": route,
+                            "route_reason": route_reason})
+            count_ocr += route == "ocr"
+            if count_ocr > count_ocr_done and (
+                ocr_chunk is None or count_ocr - count_ocr_done < ocr_chunk
+            ):
+                continue  # wait for more pages to OCR together
+            if count_ocr > count_ocr_done:
+                if progress is not None:
+                    progress("ocr", count_ocr_done, count_ocr)
+                ocr_failed |= not _ocr_pages(file_obj, waiting, languages, tesseract_timeout)
+                count_ocr_done = count_ocr
+            for page in waiting:
+                if key is not None:
+                    pages.append(page)
+                yield page
+            waiting = []
+
+        if waiting:  # last pages routed to OCR
+            if progress is not None:
+                progress("ocr", count_ocr_done, count_ocr)
+            ocr_failed |= not _ocr_pages(file_obj, waiting, languages, tesseract_timeout)
+            count_ocr_done = count_ocr
+            for page in waiting:
+                if key is not None:
+                    pages.append(page)
+                yield page
+        elif count_page == 0:  # PDFminer failed or found no pages, OCR everything
+            if progress is not None:
+                progress("ocr", 0, None)
+            pages_ocr_path = process_ocr_path(file_obj, languages, tesseract_timeout)
+            ocr_failed = pages_ocr_path is None
+            for page_ind, ocr_path in enumerate(pages_ocr_path or [], 1):
+                count_page = count_ocr = count_ocr_done = page_ind
+                page = {"page_ind": page_ind, "text_path": "", "ocr_path": ocr_path,
+                        "route": "ocr", "route_reason": "text path failed"}
+                if key is not None:
+                    pages.append(page)
+                yield page
+        if count_ocr and progress is not None:
+            progress("ocr", count_ocr_done, count_ocr)
+        logging.info(f'"{basename}": {count_ocr} of {count_page} pages routed to OCR')
+        add_metric("pages_total", count_page - count_ocr, route="text")
+        add_metric("pages_total", count_ocr, route="ocr")
+        add_metric("documents_total", status="success")
+
+        ret_val = {"name": basename, "count_page": count_page, "status": "success"}
+        if key is not None and not ocr_failed:  # don't keep a failed OCR around
+            cache_put(key, {**ret_val, "pages": pages})
+        yield ret_val
+    finally:
+        _release_file(file_obj, resource_temporary)
+
+
+# -----------------------------------------------------------------------------
+def process_file_or_url(
+    resource: Path | datastructures.UploadFile | HttpUrl | str,
+    languages: str | None = None,
+    tesseract_timeout: int | None = None,
+    progress: Callable | None = None,
+    text_backend: str | None = None,
+) -> dict:
+    """
+    takes PDF resource, tries text extraction through text path, then OCR. returns dict with fail/success status, basename, text, and page count.
+    progress(stage, done, total), if given, is called as pages go through the "text" and "ocr" stages
+    """
+    return collect_result(
+        iter_file_or_url(resource, languages, tesseract_timeout, progress, text_backend=text_backend)
+    )
+
+
+# -----------------------------------------------------------------------------
+def collect_result(items: Iterable[dict]) -> dict:
+    "takes items yielded by iter_file_or_url or iter_sandboxed, returns them as one process_file_or_url result"
+    pages = []
+    for item in items:
+        if "page_ind" in item:
+            pages.append(item)
+        else:
+            ret_val = item
+    if ret_val["status"] == "success":
+        ret_val["pages"] = pages
+    return ret_val
+
+
+# -----------------------------------------------------------------------------
+def page_text(page: dict) -> str:
+    """
+    takes page dict, returns the text of the path it was routed to: OCR'd pages may have a partial text layer
+    (e.g.; a caption), which the OCR text repeats
+    """
+    if page["route"] == "ocr":
+        return page["ocr_path"] or page["text_path"]  # what the text path found, if OCR failed
+    return page["text_path"]
+
+
+# -----------------------------------------------------------------------------
+def get_all_text(pdf: dict) -> str:
+    "takes processed PDF dictionary and returns the text of each page (see page_text()) concatenated"
+    delim = (linesep + linesep)
+    return delim.join([page_text(p) for p in pdf["pages"]])
+
+
+# -----------------------------------------------------------------------------
+def list_dir(d: Path) -> list[Path]:
+    "takes local directory path, returns sorted list of PDF files found in it recursively"
+    pdfs = []
+    for _path in sorted(d.glob("**/*.pdf")):
+        if not _path.is_file():
+            logging.info(
+                f'path "{_path}" is not a regular file, or cannot be read, skipping...'
+            )
+            continue
+        pdfs.append(_path)
+    return pdfs
 
 
 # -----------------------------------------------------------------------------
 def process_dir(
-    d: Path, languages: str | None = None, tesseract_timeout: int | None = None
+    d: Path,
+    languages: str | None = None,
+    tesseract_timeout: int | None = None,
+    text_backend: str | None = None,
 ) -> list:
     "takes local directory path, PDF batch processes it, returns list of objects returned by process_file_or_url"
+    return process_batch(list_dir(d), languages, tesseract_timeout, text_backend=text_backend)
+
+
+# -----------------------------------------------------------------------------
+def _batch_child(conn, resource, languages: str, tesseract_timeout: int, ocr_jobs: int,
+                 text_backend: str | None, settings: dict, log_level: str):
+    """
+    runs in batch child process: processes one resource with the parent's settings (CHILD_SETTINGS), sends
+    ('progress', tuple)s and ('result', dict) back through conn
+    """
+    global _OCR_GATE, OCR_JOBS, _OCR_POOL
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()  # so a timeout also kills Tesseract / Ghostscript children
+    _apply_settings(settings, log_level)
+    _OCR_GATE = conn
+    _OCR_POOL = GateOCRPool(conn)  # one pool of warm workers in the parent, instead of one per document
+    OCR_JOBS = ocr_jobs
+    METRICS.clear()
+
+    def progress(stage: str, done: int, total: int | None):
+        conn.send(("progress", (stage, done, total)))
+
+    try:
+        result = process_file_or_url(
+            resource, languages, tesseract_timeout, progress, text_backend=text_backend
+        )
+    except Exception as e:
+        logging.error(f'processing "{resource}" failed: {e}')
+        add_metric("documents_total", status="fail")
+        result = {"name": resource_name(resource), "status": "fail", "error": str(e)}
+    conn.send(("result", {"result": result, "metrics": METRICS}))
+    conn.close()
+
+
+# -----------------------------------------------------------------------------
+def _process_tree(pid: int) -> dict[int, int]:
+    "returns {pid: resident bytes} of process pid and all its descendants, from /proc. Empty where there's no /proc"
+    children, rss = {}, {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return {}
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as rfp:
+                fields = rfp.read().rsplit(b")", 1)[1].split()  # the command name before ")" may have spaces
+        except OSError:  # exited meanwhile
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        rss[int(entry)] = int(fields[21]) * _PAGE_SIZE
+    tree = {}
+    todo = [pid]
+    while todo:
+        pid = todo.pop()
+        if pid in rss and pid not in tree:
+            tree[pid] = rss[pid]
+            todo.extend(children.get(pid, []))
+    return tree
+
+
+# -----------------------------------------------------------------------------
+def _kill_process_group(proc: Process):
+    """
+    terminates child process (batch, sandbox or OCR child) and everything it started, including OCR children that
+    moved to process groups of their own
+    """
+    descendants = _process_tree(proc.pid)
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (AttributeError, OSError):
+        proc.kill()
+    for pid in descendants:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:  # already gone
+            pass
+    proc.join()
+
+
+# -----------------------------------------------------------------------------
+class Sandbox:
+    """
+    limits of a child process processing one document: a wall-clock deadline of timeout seconds, and FILE_MAX_RSS_MB
+    of resident memory for it and everything it starts, checked every SANDBOX_POLL seconds. A child that breaks one
+    is killed. Remembers the progress the child reported last, for its failure_result()
+    """
+
+    def __init__(self, proc: Process, name: str, timeout: int | None):
+        self.proc = proc
+        self.name = name
+        self.timeout = timeout
+        self.max_rss_mb = FILE_MAX_RSS_MB
+        self.started = monotonic()
+        self.deadline = self.started + timeout if timeout else None
+        self.peak_rss_mb = 0.0
+        self.last_progress = ("start", 0, None)
+        self._next_poll = self.started
+
+    def progress(self, stage: str, done: int, total: int | None):
+        self.last_progress = (stage, done, total)
+
+    def wait_timeout(self) -> float | None:
+        "returns seconds until the next check() is due, None if there are no limits to check"
+        due = [t for t in [self.deadline, self._next_poll if self.max_rss_mb else None] if t is not None]
+        return max(0, min(due) - monotonic()) if due else None
+
+    def check(self) -> dict | None:
+        "kills the child if it broke a limit and returns its failure_result(), else returns None"
+        now = monotonic()
+        if self.deadline is not None and now >= self.deadline:
+            return self.stop("timeout", f"timed out after {self.timeout}s", self.timeout)
+        if self.max_rss_mb and now >= self._next_poll:
+            self._next_poll = now + SANDBOX_POLL
+            rss_mb = sum(_process_tree(self.proc.pid).values()) / (1 << 20)
+            self.peak_rss_mb = max(self.peak_rss_mb, rss_mb)
+            if rss_mb > self.max_rss_mb:
+                return self.stop(
+                    "memory", f"used {rss_mb:.0f} MB, over the {self.max_rss_mb} MB limit", self.max_rss_mb
+                )
+        return None
+
+    def stop(self, kind: str, error: str, limit: float) -> dict:
+        "kills the child for breaking limit, returns its failure_result()"
+        _kill_process_group(self.proc)
+        logging.error(f'processing "{self.name}" {error}')
+        add_metric("documents_total", status=kind)
+        return self.failure(kind, error, limit)
+
+    def crashed(self) -> dict:
+        "returns failure_result() of a child that died without a result"
+        self.proc.join()
+        error = f"crashed with exit code {self.proc.exitcode}"
+        logging.error(f'processing "{self.name}" {error}')
+        add_metric("documents_total", status="crash")
+        return self.failure("crash", error)
+
+    def failure(self, kind: str, error: str, limit: float | None = None) -> dict:
+        stage, done, total = self.last_progress
+        return failure_result(
+            self.name, kind, error, limit=limit, stage=stage, pages_done=done, pages_total=total,
+            seconds=round(monotonic() - self.started, 2),
+            peak_rss_mb=round(self.peak_rss_mb, 1) if self.max_rss_mb else None,  # only measured for the limit
+        )
+
+
+# -----------------------------------------------------------------------------
+def iter_batch(
+    resources: list,
+    languages: str | None = None,
+    tesseract_timeout: int | None = None,
+    workers: int | None = None,
+    ocr_workers: int | None = None,
+    file_timeout: int | None = None,
+    text_backend: str | None = None,
+) -> Iterator[dict]:
+    """
+    takes list of resources (local Paths, URLs), processes up to workers of them at a time in child processes,
+    at most ocr_workers of them in the OCR stage. A document that fails, crashes, exceeds file_timeout seconds or
+    FILE_MAX_RSS_MB gets a "fail" result (see Sandbox) without affecting the rest. yields process_file_or_url results
+    in input order, each as soon as it and all before it are done. At most workers finished results are held back
+    waiting for a slow one
+    """
     if languages is None:
         languages = LANGUAGES
     if tesseract_timeout is None:
         tesseract_timeout = TESSERACT_TIMEOUT
+    if workers is None:
+        workers = BATCH_WORKERS
+    if ocr_workers is None:
+        ocr_workers = OCR_WORKERS
+    if file_timeout is None:
+        file_timeout = FILE_TIMEOUT
+    workers = max(1, workers)
+    ocr_workers = max(1, min(ocr_workers, workers))
 
-    results = []
-    for filename in d.glob("**/*.pdf"):
-        _path = Path(filename)
-        if not _path.is_file:
-            print(
-                f'path "{filename}" is not a regular file, or cannot be read, skipping...'
+    if workers == 1 and file_timeout is None and FILE_MAX_RSS_MB is None:  # nothing to gain from child processes
+        for resource in iter_prefetched(resources):
+            yield process_file_or_url(
+                resource, languages, tesseract_timeout, text_backend=text_backend
             )
-        results.append(process_file_or_url(_path, languages, tesseract_timeout))
-    return results
+        return
+
+    # split cores between concurrent OCR runs, so OCRmyPDF doesn't oversubscribe them
+    ocr_jobs = OCR_JOBS or max(1, (cpu_count() or 1) // ocr_workers)
+    # not forked: the parent runs download and OCR page threads, whose held locks a fork would copy
+    context = _child_context()
+    settings, log_level = _child_settings()
+    done = {}  # index -> result, finished but not yet yielded
+    next_ind = 0
+    pending = list(enumerate(resources))
+    running = {}  # Connection -> [index, Sandbox, holds OCR slot]
+    ocr_queue = []  # Connections waiting for an OCR slot
+    ocr_running = 0
+    page_executor = None  # threads feeding OCRPool pages sent by children, started by the first one
+    pages_done = Queue()  # (Connection, task id, status, text or error) of those pages
+    wake_conn, wake_send = Pipe(duplex=False)  # wakes up the loop when one is done
+    wake_lock = Lock()
+
+    def ocr_page(conn, task_id: int, task: tuple):
+        try:
+            pages_done.put((conn, task_id, "ok", get_ocr_pool().ocr_page(*task)))
+        except Exception as e:
+            pages_done.put((conn, task_id, "error", str(e)))
+        with wake_lock:
+            wake_send.send(None)
+
+    def finish(conn, result):
+        nonlocal ocr_running
+        index, _, holds_ocr = running.pop(conn)
+        if conn in ocr_queue:
+            ocr_queue.remove(conn)
+        if holds_ocr:
+            ocr_running -= 1
+        conn.close()
+        done[index] = result
+
+    while pending or running:
+        while pending and len(running) < workers and len(done) < workers:
+            index, resource = pending.pop(0)
+            parent_conn, child_conn = context.Pipe()
+            proc = context.Process(
+                target=_batch_child,
+                args=(child_conn, resource, languages, tesseract_timeout, ocr_jobs,
+                      text_backend, settings, log_level),
+            )
+            proc.start()
+            child_conn.close()
+            running[parent_conn] = [index, Sandbox(proc, resource_name(resource), file_timeout), False]
+
+        timeouts = [t for t in (r[1].wait_timeout() for r in running.values()) if t is not None]
+        for conn in wait(list(running) + [wake_conn], min(timeouts) if timeouts else None):
+            if conn is wake_conn:
+                wake_conn.recv()
+                continue
+            sandbox = running[conn][1]
+            try:
+                msg, payload = conn.recv()
+            except (EOFError, OSError):  # child died without a result
+                finish(conn, sandbox.crashed())
+                continue
+            if msg == "progress":
+                sandbox.progress(*payload)
+            elif msg == "ocr":
+                ocr_queue.append(conn)
+            elif msg == "ocr_done":
+                running[conn][2] = False
+                ocr_running -= 1
+            elif msg == "ocr_page":
+                if page_executor is None:
+                    page_executor = ThreadPoolExecutor(get_ocr_pool().workers, thread_name_prefix="pdfextract_ocr")
+                page_executor.submit(ocr_page, conn, *payload)
+            elif msg == "result":
+                sandbox.proc.join()
+                merge_metrics(payload["metrics"])
+                finish(conn, payload["result"])
+
+        for conn in list(running):
+            failure = running[conn][1].check()
+            if failure is not None:
+                finish(conn, failure)
+
+        while not pages_done.empty():
+            conn, task_id, status, payload = pages_done.get()
+            if conn in running:  # not stopped meanwhile
+                conn.send(("page", (task_id, status, payload)))
+
+        while ocr_queue and ocr_running < ocr_workers:
+            conn = ocr_queue.pop(0)
+            running[conn][2] = True
+            ocr_running += 1
+            conn.send(("grant", None))
+
+        while next_ind in done:
+            yield done.pop(next_ind)
+            next_ind += 1
+
+    if page_executor is not None:
+        page_executor.shutdown(cancel_futures=True)
+    wake_conn.close()
+    wake_send.close()
+
+
+# -----------------------------------------------------------------------------
+def process_batch(
+    resources: list,
+    languages: str | None = None,
+    tesseract_timeout: int | None = None,
+    workers: int | None = None,
+    ocr_workers: int | None = None,
+    file_timeout: int | None = None,
+    text_backend: str | None = None,
+) -> list:
+    "like iter_batch, but returns list of all results, in input order"
+    return list(
+        iter_batch(resources, languages, tesseract_timeout, workers, ocr_workers,
+                   file_timeout, text_backend)
+    )
+
+
+# -----------------------------------------------------------------------------
+def sandboxed() -> bool:
+    "returns whether iter_sandboxed runs documents in child processes, which it does if FILE_TIMEOUT or FILE_MAX_RSS_MB is set"
+    return FILE_TIMEOUT is not None or FILE_MAX_RSS_MB is not None
+
+
+# -----------------------------------------------------------------------------
+def _sandbox_child(conn, resource: Path | str, languages: str | None, tesseract_timeout: int | None,
+                   ocr_chunk: int | None, text_backend: str | None, settings: dict, log_level: str):
+    """
+    runs in sandbox child process: processes one resource with the parent's settings (CHILD_SETTINGS), sends
+    ('progress', tuple)s and ('item', dict) of each item of iter_file_or_url back through conn, then ('done', METRICS)
+    """
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()  # so a timeout also kills Tesseract / Ghostscript children
+    _apply_settings(settings, log_level)
+    METRICS.clear()
+
+    def progress(stage: str, done: int, total: int | None):
+        conn.send(("progress", (stage, done, total)))
+
+    try:
+        for item in iter_file_or_url(resource, languages, tesseract_timeout, progress, ocr_chunk, text_backend):
+            conn.send(("item", item))
+    except Exception as e:
+        logging.error(f'processing "{resource}" failed: {e}')
+        add_metric("documents_total", status="fail")
+        conn.send(("item", {"name": str(resource), "status": "fail", "error": str(e)}))
+    conn.send(("done", METRICS))
+    conn.close()
+
+
+# -----------------------------------------------------------------------------
+def iter_sandboxed(
+    resource: Path | datastructures.UploadFile | HttpUrl | str,
+    languages: str | None = None,
+    tesseract_timeout: int | None = None,
+    progress: Callable | None = None,
+    ocr_chunk: int | None = None,
+    text_backend: str | None = None,
+) -> Iterator[dict]:
+    """
+    like iter_file_or_url, but if sandboxed(), runs it in a child process under the limits of a Sandbox. A child that
+    breaks one, or crashes, ends the document with its failure_result(), and takes nothing else down with it.
+    safe to call from threads of a web server. Uploads are saved and URLs downloaded here, in the parent, which
+    hands the child the local copy: the child can't read the upload, and a URL may be prefetched already
+    """
+    if not sandboxed():
+        yield from iter_file_or_url(resource, languages, tesseract_timeout, progress, ocr_chunk, text_backend)
+        return
+
+    name = None  # of an upload or URL, which the child only knows by its temporary copy
+    if not isinstance(resource, Path):
+        file_obj, name = file_details(resource)
+        if file_obj is None:
+            if isinstance(resource, datastructures.UploadFile):
+                resource = resource.filename
+            logging.error(f'failed to locate FileOrURL "{resource}"')
+            add_metric("documents_total", status="fail")
+            yield {"name": str(resource), "status": "fail"}
+            return
+        resource = Path(file_obj)
+
+    context = _child_context()
+    parent_conn, child_conn = context.Pipe()
+    proc = context.Process(
+        target=_sandbox_child,
+        args=(child_conn, resource, languages, tesseract_timeout, ocr_chunk, text_backend,
+              *_child_settings()),
+    )
+    proc.start()
+    child_conn.close()
+    sandbox = Sandbox(proc, name or resource_name(resource), FILE_TIMEOUT)
+    try:
+        while True:
+            failure = sandbox.check()
+            if failure is not None:
+                yield failure
+                return
+            if not parent_conn.poll(sandbox.wait_timeout()):
+                continue
+            try:
+                msg, payload = parent_conn.recv()
+            except (EOFError, OSError):  # child died without a result
+                yield sandbox.crashed()
+                return
+            if msg == "progress":
+                sandbox.progress(*payload)
+                if progress is not None:
+                    progress(*payload)
+            elif msg == "item":
+                if name is not None and "name" in payload:
+                    payload["name"] = name
+                yield payload
+            elif msg == "done":
+                merge_metrics(payload)
+                proc.join()
+                return
+    finally:
+        if proc.is_alive():  # closed early, e.g.; the client of a stream went away
+            _kill_process_group(proc)
+        parent_conn.close()
+        if name is not None:
+            _release_file(resource, True)
+
+
+# -----------------------------------------------------------------------------
+def process_sandboxed(
+    resource: Path | datastructures.UploadFile | HttpUrl | str,
+    languages: str | None = None,
+    tesseract_timeout: int | None = None,
+    progress: Callable | None = None,
+    text_backend: str | None = None,
+) -> dict:
+    "like process_file_or_url, but through iter_sandboxed"
+    return collect_result(
+        iter_sandboxed(resource, languages, tesseract_timeout, progress, text_backend=text_backend)
+    )
 
 
 # -----------------------------------------------------------------------------
@@ -374,35 +2876,267 @@ def create_output_dir(_path: str) -> bool:
 
 
 # -----------------------------------------------------------------------------
-def main():
-    "main function called when running command-line tool"
-    global LANGUAGES, TESSERACT_TIMEOUT
+def layout_page(page: dict, layout: str) -> dict:
+    "takes page dict, returns it as it is in layout, see OUTPUT_LAYOUTS"
+    if layout != "compact":
+        return page
+    return {"page_ind": page["page_ind"], "route": page["route"], "route_reason": page["route_reason"],
+            "text": page_text(page)}
 
-    setdefaulttimeout(HTTP_SOCK_TIMEOUT)
 
-    args = parse_params()
-    set_up_logging(args.log_level, "STDERR")
+# -----------------------------------------------------------------------------
+def layout_result(pdf: dict, layout: str | None = None) -> dict:
+    "takes processed PDF dictionary, returns it as it is in layout (None means OUTPUT_LAYOUT), see OUTPUT_LAYOUTS"
+    if layout is None:
+        layout = OUTPUT_LAYOUT
+    if layout == "pages" or "pages" not in pdf:
+        return pdf
+    if layout == "text":
+        return {**{k: v for k, v in pdf.items() if k != "pages"}, "text": get_all_text(pdf)}
+    return {**pdf, "pages": [layout_page(p, layout) for p in pdf["pages"]]}
+
+
+# -----------------------------------------------------------------------------
+def dump_json(obj) -> str:
+    "returns obj serialized as compact JSON, by orjson if it's installed, with what JSON has no type for as strings"
+    if orjson is not None:
+        return orjson.dumps(obj, default=str).decode("utf-8")
+    return json.dumps(obj, default=str, ensure_ascii=False, separators=(",", ":"))
+
+
+# -----------------------------------------------------------------------------
+def _write_xml_value(xf: etree.xmlfile, tag: str, value):
+    "writes value as element tag to lxml incremental writer xf, typed the way dicttoxml does it"
+    if isinstance(value, dict):
+        with xf.element(tag, type="dict"):
+            for key, item in value.items():
+                _write_xml_value(xf, key, item)
+    elif isinstance(value, (list, tuple)):
+        with xf.element(tag, type="list"):
+            for item in value:
+                _write_xml_value(xf, "item", item)
+    elif value is None:
+        with xf.element(tag, type="null"):
+            pass
+    elif isinstance(value, bool):
+        with xf.element(tag, type="bool"):
+            xf.write("true" if value else "false")
+    else:
+        with xf.element(tag, type=type(value).__name__ if isinstance(value, (int, float)) else "str"):
+            xf.write(XML_BAD_CHARS_RE.sub("", str(value)))
+
+
+# -----------------------------------------------------------------------------
+def write_xml(pdfs: Iterable[dict], wfp, layout: str | None = None, single: bool = False):
+    """
+    writes processed PDF dictionaries to binary file wfp as XML, one element at a time with lxml, flushing after
+    each PDF so the output can be followed. they are <item>s of <root>, or with single, the one PDF is <root>
+    """
+    wfp.write(XML_HEADER.encode("utf-8"))
+    with etree.xmlfile(wfp, encoding="utf-8") as xf:
+        if single:
+            with xf.element("root"):
+                for key, value in layout_result(next(iter(pdfs)), layout).items():
+                    _write_xml_value(xf, key, value)
+            return
+        with xf.element("root"):
+            for pdf in pdfs:
+                with timed_stage("output", format="XML"):
+                    _write_xml_value(xf, "item", layout_result(pdf, layout))
+                    xf.flush()
+                    wfp.flush()
+
+
+# -----------------------------------------------------------------------------
+def write_alto(pdf: dict, wfp):
+    """
+    writes processed PDF dictionary to binary file wfp as ALTO v4 XML: a Page per page, with a TextBlock per
+    paragraph, then TextLines of Strings. There are no coordinates, the text paths don't keep them
+    """
+    def alto(tag: str) -> str:
+        return f"{{{ALTO_NS}}}{tag}"
+
+    with etree.xmlfile(wfp, encoding="utf-8") as xf:
+        xf.write_declaration()
+        with xf.element(alto("alto"), nsmap={None: ALTO_NS}):
+            with xf.element(alto("Description")):
+                with xf.element(alto("MeasurementUnit")):
+                    xf.write("pixel")
+                with xf.element(alto("sourceImageInformation")), xf.element(alto("fileName")):
+                    xf.write(XML_BAD_CHARS_RE.sub("", str(pdf["name"])))
+            with xf.element(alto("Layout")):
+                for page in pdf.get("pages", []):
+                    page_id = f"p{page['page_ind']}"
+                    text = XML_BAD_CHARS_RE.sub("", layout_page(page, "compact")["text"])
+                    with xf.element(alto("Page"), ID=page_id, PHYSICAL_IMG_NR=str(page["page_ind"])), \
+                            xf.element(alto("PrintSpace")):
+                        blocks = [b for b in _split(r"\n\s*\n", text) if b.strip()]
+                        for ib, block in enumerate(blocks, 1):
+                            with xf.element(alto("TextBlock"), ID=f"{page_id}_b{ib}"):
+                                lines = [line.split() for line in block.splitlines() if line.strip()]
+                                for il, words in enumerate(lines, 1):
+                                    with xf.element(alto("TextLine"), ID=f"{page_id}_b{ib}_l{il}"):
+                                        for iw, word in enumerate(words):
+                                            if iw:
+                                                with xf.element(alto("SP")):
+                                                    pass
+                                            with xf.element(alto("String"), CONTENT=word):
+                                                pass
+                    xf.flush()
+
+
+# -----------------------------------------------------------------------------
+def format_result(pdf: dict, output_format: str, layout: str | None = None) -> str:
+    "takes processed PDF dictionary, returns it serialized as a standalone document in output_format and layout"
+    if output_format == "TXT":
+        return get_all_text(pdf)
+    elif output_format in ["XML", "ALTO"]:
+        buffer = BytesIO()
+        if output_format == "XML":
+            write_xml([pdf], buffer, layout, single=True)
+        else:
+            write_alto(pdf, buffer)
+        return buffer.getvalue().decode("utf-8")
+    return dump_json(layout_result(pdf, layout))  # JSON, NDJSON
+
+
+# -----------------------------------------------------------------------------
+def write_results(results: Iterable[dict], output_format: str, output_path: str, layout: str | None = None):
+    """
+    writes each processed PDF dictionary as soon as it arrives from results, so only one is held in memory.
+    STDOUT gets a single stream in output_format, a directory gets a separate file per PDF
+    """
+    if output_path == "STDOUT":
+        "writing results to stdout in some format"
+        if output_format == "XML":
+            stdout.flush()
+            write_xml(results, stdout.buffer, layout)
+            return
+        if output_format == "JSON":
+            stdout.write("[")
+        for ii, pdf in enumerate(results, 1):  # 1-based counting
+            with timed_stage("output", format=output_format):
+                if output_format == "TXT":
+                    # TODO: find some standard way to delimit these if it even makes sense
+                    if pdf["status"] == "success":
+                        all_text = get_all_text(pdf)
+                        stdout.write(
+                            f"--- {ii:03} {pdf['name']} {pdf['count_page']}pages\n{all_text}\n"
+                        )
+                    else:
+                        logging.error(f"{ii}: failed to process PDF file \"{pdf['name']}\"")
+                elif output_format == "JSON":
+                    # same bytes as dump_json() of the whole list would produce
+                    stdout.write(("," if ii > 1 else "") + dump_json(layout_result(pdf, layout)))
+                elif output_format == "NDJSON":
+                    stdout.write(dump_json(layout_result(pdf, layout)) + "\n")
+            stdout.flush()
+        if output_format == "JSON":
+            stdout.write("]")
+    else:
+        "writing separate files to a directory"
+        for ii, pdf in enumerate(results):
+            if pdf["status"] == "success":
+                write_result_file(pdf, output_format, path.join(output_path, output_name(pdf, ii, output_format)))
+            else:
+                logging.error(f"{ii}: failed to process PDF file \"{pdf['name']}\"")
+
+
+# -----------------------------------------------------------------------------
+def output_name(pdf: dict, ii: int, output_format: str) -> str:
+    "returns name of the file a processed PDF dictionary is written to in an output directory"
+    return f"{pdf['name']}-pdfextract{ii:03}.{OUTPUT_EXTENSIONS[output_format]}"
+
 
-    "a little more config validation"
-    if args.output_path != "STDOUT" and args.output_format != "TXT":
+# -----------------------------------------------------------------------------
+def write_result_file(pdf: dict, output_format: str, outfilepath: str) -> bool:
+    """
+    writes processed PDF dictionary to outfilepath in output_format, returns False if that failed.
+    the file is written under a hidden temporary name and renamed when complete, so a partial file never
+    looks like a result
+    """
+    tmp_path = path.join(path.dirname(outfilepath), f".{path.basename(outfilepath)}.tmp")
+    try:
+        with timed_stage("output", format=output_format), open(tmp_path, "wb") as wfp:
+            if output_format == "XML":
+                write_xml([pdf], wfp, single=True)
+            elif output_format == "ALTO":
+                write_alto(pdf, wfp)
+            else:
+                wfp.write(format_result(pdf, output_format).encode("utf-8"))
+        os.replace(tmp_path, outfilepath)
+    except Exception as e:
         logging.error(
-            f'format "{args.output_format}" can only be used with STDOUT'
-        )  # not yet implemented
-        _exit(0)
+            f'failed to write extract results file "{outfilepath}": {e}'
+        )
+        try:
+            remove(tmp_path)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+# -----------------------------------------------------------------------------
+def read_journal(journal_path: str, settings: dict) -> set[str] | None:
+    """
+    returns resources recorded as done in journal, or None if there is none or it was written with other settings.
+    documents that failed (maybe on a passing download or OCR error) don't count as done, so resume retries them
+    """
+    try:
+        with open(journal_path, "r", encoding="utf-8") as rfp:
+            lines = rfp.read().splitlines()
+    except FileNotFoundError:
+        return None
+    entries = []
+    for line in lines:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:  # last line cut short by a crash
+            break
+    if not entries or entries[0].get("settings") != settings:
+        logging.error(f'journal "{journal_path}" was written with other settings, starting over')
+        return None
+    return {e["resource"] for e in entries[1:] if e.get("status") == "success"}
+
+
+# -----------------------------------------------------------------------------
+def write_results_journaled(resources: list, output_format: str, output_path: str, resume: bool = False):
+    """
+    like write_results to a directory, but records each document in a journal in output_path as soon as its
+    output is written. with resume, documents the journal already has are skipped, continuing an interrupted run
+    """
+    journal_path = path.join(output_path, JOURNAL_NAME)
+    settings = {**result_settings(LANGUAGES, TESSERACT_TIMEOUT, TEXT_BACKEND), "output_format": output_format,
+                "layout": OUTPUT_LAYOUT}
+    done = read_journal(journal_path, settings) if resume else None
+    keys = [str(r.resolve()) if isinstance(r, Path) else str(r) for r in resources]
+    todo = [(ii, r) for ii, r in enumerate(resources) if done is None or keys[ii] not in done]
+    if done is not None:
+        logging.info(f"resuming: {len(resources) - len(todo)} of {len(resources)} documents already done")
+
+    with open(journal_path, "a" if done is not None else "w", encoding="utf-8") as journal:
+        if done is None:
+            journal.write(json.dumps({"settings": settings}) + "\n")
+        for (ii, resource), pdf in zip(todo, iter_batch([r for _, r in todo])):
+            if pdf["status"] == "success":
+                if not write_result_file(pdf, output_format, path.join(output_path, output_name(pdf, ii, output_format))):
+                    continue  # not done, retried on resume
+            else:
+                logging.error(f"{ii}: failed to process PDF file \"{pdf['name']}\"")
+            journal.write(json.dumps({"resource": keys[ii], "status": pdf["status"]}) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
 
-    "prepare output dir if necessary, and set globals"
-    if args.output_path != "STDOUT":
-        if not create_output_dir(args.output_path):
-            _exit(0)
-    LANGUAGES = args.languages
-    TESSERACT_TIMEOUT = args.tesseract_timeout
 
-    "process loop"
-    results = []
-    for arg in args.input_paths:
+# -----------------------------------------------------------------------------
+def collect_resources(input_paths: list[str]) -> list[Path | str]:
+    "takes command-line input paths, returns PDF files (directories expanded) as Paths and URLs as strings"
+    resources = []
+    for arg in input_paths:
 
         if search(URL_RE, arg):
-            results.append(process_file_or_url(arg))
+            resources.append(arg)
             continue
         _path = Path(arg)
 
@@ -410,50 +3144,190 @@ def main():
             logging.info(f'path "{arg}" not found, skipping...')
         elif _path.is_file():
             if search(PDF_RE, arg):
-                results.append(process_file_or_url(_path))
+                resources.append(_path)
             else:
                 logging.info(f'path "{arg}" does not seem to be a PDF, skipping...')
         elif _path.is_dir():
-            results.extend(process_dir(_path))
+            resources.extend(list_dir(_path))
         else:
             logging.info(
                 f'path "{arg}" is neither a regular file, URL, nor directory, or cannot be read; skipping...'
             )
+    return resources
 
-    "output results"
-    if args.output_path == "STDOUT":
-        "writing results to stdout in some format"
-        if args.output_format == "TXT":
-            # TODO: find some standard way to delimit these if it even makes sense
-            for ii, pdf in enumerate(results, 1):  # 1-based counting
-                if pdf["status"] == "success":
-                    all_text = get_all_text(pdf)
-                    stdout.write(
-                        f"--- {ii:03} {pdf['name']} {pdf['count_page']}pages\n{all_text}\n"
-                    )
-                else:
-                    logging.error(f"{ii}: failed to process PDF file \"{pdf['name']}\"")
-        elif args.output_format == "JSON":
-            stdout.write(json.dumps(results))
-        elif args.output_format == "XML":
-            stdout.write(dicttoxml(results).decode("utf-8"))
+
+# -----------------------------------------------------------------------------
+def load_manifest(output_path: str) -> dict:
+    "returns sync manifest kept in output directory, or an empty one if there is none yet"
+    try:
+        with open(path.join(output_path, MANIFEST_NAME), "r", encoding="utf-8") as rfp:
+            return json.load(rfp)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logging.error(f'cannot read manifest in "{output_path}", reprocessing everything: {e}')
+    return {"next_id": 0, "files": {}}
+
+
+# -----------------------------------------------------------------------------
+def save_manifest(output_path: str, manifest: dict):
+    "writes sync manifest to output directory, atomically, so an interrupted run leaves the previous one intact"
+    manifest_path = path.join(output_path, MANIFEST_NAME)
+    with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as wfp:
+        json.dump(manifest, wfp)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+# -----------------------------------------------------------------------------
+def _remove_output(output_path: str, entry: dict):
+    "removes output file of a sync manifest entry, if it's still there"
+    try:
+        remove(path.join(output_path, entry["output"]))
+    except FileNotFoundError:
+        pass
+
+
+# -----------------------------------------------------------------------------
+def sync_dir(input_paths: list[str], output_format: str, output_path: str, settle: int = 0) -> int:
+    """
+    processes only the PDFs under input_paths that are new or changed since the last sync to output_path, going
+    by its manifest (path, size, mtime, sha256, settings of each PDF), and removes outputs of PDFs that are gone.
+    PDFs modified less than settle seconds ago may still be being written, and are left for the next sync.
+    returns number of PDFs processed
+    """
+    manifest = load_manifest(output_path)
+    files = manifest["files"]  # resolved path -> entry
+    settings = {**result_settings(LANGUAGES, TESSERACT_TIMEOUT, TEXT_BACKEND), "output_format": output_format,
+                "layout": OUTPUT_LAYOUT}
+    settings_key = sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+    for src in [src for src in files if not path.isfile(src)]:
+        logging.info(f'sync: "{src}" is gone, removing its output')
+        _remove_output(output_path, files.pop(src))
+
+    changed = []  # (Path, resolved path, stat, sha256)
+    count_unchanged = 0
+    min_mtime = time() - settle
+    for resource in collect_resources(input_paths):
+        if not isinstance(resource, Path):
+            logging.error(f'sync: only local files can be synced, skipping "{resource}"')
+            continue
+        src = str(resource.resolve())
+        st = resource.stat()
+        if st.st_mtime > min_mtime:
+            continue
+        entry = files.get(src)
+        if entry is not None and entry["settings"] == settings_key:
+            if entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+                count_unchanged += 1
+                continue
+        digest = file_sha256(resource)
+        if entry is not None and entry["settings"] == settings_key and entry["sha256"] == digest:
+            entry["mtime_ns"] = st.st_mtime_ns  # touched, not changed
+            count_unchanged += 1
+            continue
+        changed.append((resource, src, st, digest))
+    logging.info(f"sync: {len(changed)} new or changed PDFs, {count_unchanged} unchanged")
+
+    last_save = monotonic()
+    for (resource, src, st, digest), pdf in zip(changed, iter_batch([c[0] for c in changed])):
+        entry = files.pop(src, None)
+        if pdf["status"] != "success":
+            logging.error(f'sync: failed to process PDF file "{src}"')
+            if entry is not None:  # it's stale now
+                _remove_output(output_path, entry)
+            continue
+        if entry is None:
+            file_id = manifest["next_id"]
+            manifest["next_id"] += 1
+        else:
+            file_id = entry["id"]
+        outname = output_name(pdf, file_id, output_format)
+        if entry is not None and entry["output"] != outname:
+            _remove_output(output_path, entry)
+        if not write_result_file(pdf, output_format, path.join(output_path, outname)):
+            continue
+        files[src] = {"id": file_id, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest,
+                      "settings": settings_key, "output": outname}
+        if monotonic() - last_save > MANIFEST_SAVE_INTERVAL:  # keep progress if interrupted
+            save_manifest(output_path, manifest)
+            last_save = monotonic()
+    save_manifest(output_path, manifest)
+    return len(changed)
+
+
+# -----------------------------------------------------------------------------
+def main():
+    "main function called when running command-line tool"
+    global LANGUAGES, TESSERACT_TIMEOUT, BATCH_WORKERS, OCR_WORKERS, FILE_TIMEOUT
+    global CACHE_DIR, CACHE_MAX_MB, CACHE_MAX_AGE, MAX_PAGES, TEXT_BACKEND
+    global DOWNLOAD_WORKERS, DOWNLOAD_MAX_MB, OCR_ENGINE, OCR_PAGE_WORKERS, OCR_PAGE_TIMEOUT, TRIAGE
+    global OCR_MAX_DPI, OCR_MAX_MPIXELS, OUTPUT_LAYOUT, FILE_MAX_RSS_MB, FILE_MAX_PAGES, FILE_MAX_MPIXELS
+
+    setdefaulttimeout(HTTP_SOCK_TIMEOUT)
+
+    args = parse_params()
+    set_up_logging(args.log_level, "STDERR")
+
+    "prepare output dir if necessary, and set globals"
+    if args.output_path != "STDOUT":
+        if not create_output_dir(args.output_path):
+            _exit(0)
+    LANGUAGES = args.languages
+    TESSERACT_TIMEOUT = args.tesseract_timeout
+    BATCH_WORKERS = args.workers
+    OCR_WORKERS = args.ocr_workers
+    FILE_TIMEOUT = args.file_timeout
+    FILE_MAX_RSS_MB = args.file_max_rss_mb
+    FILE_MAX_PAGES = args.file_max_pages
+    FILE_MAX_MPIXELS = args.file_max_mpixels
+    MAX_PAGES = args.max_pages
+    TEXT_BACKEND = args.text_backend
+    CACHE_DIR = args.cache_dir
+    CACHE_MAX_MB = args.cache_max_mb
+    CACHE_MAX_AGE = args.cache_max_age
+    DOWNLOAD_WORKERS = args.download_workers
+    DOWNLOAD_MAX_MB = args.download_max_mb
+    OCR_ENGINE = args.ocr_engine
+    OCR_PAGE_WORKERS = args.ocr_page_workers
+    OCR_PAGE_TIMEOUT = args.ocr_page_timeout or None
+    OCR_MAX_DPI = args.ocr_max_dpi
+    OCR_MAX_MPIXELS = args.ocr_max_mpixels
+    TRIAGE = not args.no_triage
+    OUTPUT_LAYOUT = args.layout
+
+    "collect inputs, then process loop"
+    if args.inspect:
+        inspect_format = args.output_format if args.output_format in ["NDJSON", "XML"] else "JSON"
+        write_results(
+            map(inspect_file_or_url, iter_prefetched(collect_resources(args.input_paths))), inspect_format, "STDOUT",
+            layout="pages",
+        )
+    elif args.sync:
+        if args.output_path == "STDOUT":
+            logging.error("--sync needs an output directory, see --output_path")
+            _exit(1)
+        while True:
+            sync_dir(args.input_paths, args.output_format, args.output_path, settle=args.watch or 0)
+            if not args.watch:
+                break
+            sleep(args.watch)
+    elif args.output_path == "STDOUT":
+        if args.resume:
+            logging.error("--resume needs an output directory, see --output_path")
+            _exit(1)
+        if args.output_format == "ALTO":
+            logging.error("ALTO is written as a file per PDF, it needs an output directory, see --output_path")
+            _exit(1)
+        write_results(iter_batch(collect_resources(args.input_paths)), args.output_format, args.output_path)
     else:
-        "writing separate text files to a directory"
-        for ii, pdf in enumerate(results):  # 1-based counting
-            if pdf["status"] == "success":
-                all_text = get_all_text(pdf)
-                outfilepath = path.join(
-                    args.output_path, f"{pdf['name']}-pdfextract{ii:03}.txt"
-                )
-                try:
-                    with open(outfilepath, "w", encoding="utf-8") as wfp:
-                        wfp.write(all_text)
-                except Exception as e:
-                    logging.error(
-                        f'failed to write extract results file "{outfilepath}": {e}'
-                    )
-            else:
-                logging.error(f"{ii}: failed to process PDF file \"{pdf['name']}\"")
+        write_results_journaled(
+            collect_resources(args.input_paths), args.output_format, args.output_path, args.resume
+        )
+
+    "per-run summary"
+    for line in metrics_report():
+        logging.info(line)
 
 
 # -----------------------------------------------------------------------------
@@ -0,0 +1,270 @@
+"""
+benchmark for the pdfextract pipeline
+Runs pdfextract over the bundled samples and synthetic scaled-up documents, reports per-stage wall time,
+pages/sec, peak RSS and cache hit rates, and compares them against a saved baseline
+Runs offline on a CPU-only box. Run with "-h" for command-line help
+"""
+
+from argparse import ArgumentParser, Namespace
+from multiprocessing import get_context
+from os import cpu_count, path
+from pathlib import Path
+from resource import RUSAGE_CHILDREN, RUSAGE_SELF, getrusage
+from sys import exit, stdout, version
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import json
+import logging
+import ocrmypdf
+import pdfminer
+import pikepdf
+import platform
+
+import pdfextract
+
+SAMPLES_DIR = Path(path.dirname(path.abspath(__file__)), "samples")
+# synthetic documents: (sample to repeat, page count)
+SYNTHETIC = [("example_file.pdf", 120), ("scansmpl.pdf", 20)]
+RASTER_DPI = 300  # OCRmyPDF renders pages for Tesseract at about this resolution
+SERIALIZE_FORMATS = ["JSON", "XML", "ALTO", "TXT"]
+
+# -----------------------------------------------------------------------------
+
+
+def parse_params() -> Namespace:
+    "parses command-line args"
+    parser = ArgumentParser()
+    parser.add_argument(
+        "-tb",
+        "--text_backends",
+        nargs="+",
+        choices=list(pdfextract.TEXT_BACKENDS),
+        default=["pdfminer"],
+        help="optional: text backends to benchmark. Defaults to pdfminer",
+    )
+    parser.add_argument(
+        "-s",
+        "--scale",
+        type=float,
+        default=1.0,
+        help="optional: multiplies page counts of synthetic documents, 0 skips them. Defaults to 1",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=1,
+        help="optional: runs per document, the fastest is reported. Defaults to 1",
+    )
+    parser.add_argument(
+        "-c",
+        "--cache",
+        action="store_true",
+        help="also run every document a second time against a warm result cache",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        help="optional: write machine-readable results to this JSON file",
+    )
+    parser.add_argument(
+        "-b",
+        "--baseline",
+        default=None,
+        help="optional: JSON file from an earlier --output run to compare against",
+    )
+    parser.add_argument(
+        "-mr",
+        "--max_regression",
+        type=float,
+        default=0.2,
+        help="optional: with --baseline, exit with 1 if any document got slower by more than this fraction. Defaults to 0.2",
+    )
+    parser.add_argument(
+        "files",
+        nargs="*",
+        help="optional: PDFs to benchmark instead of the bundled samples",
+    )
+    return parser.parse_args()
+
+
+# -----------------------------------------------------------------------------
+def make_synthetic(tmp_dir: str, scale: float) -> list[Path]:
+    "writes scaled-up documents, made by repeating pages of samples, to tmp_dir, returns their paths"
+    files = []
+    for sample, count_page in SYNTHETIC:
+        count_page = int(count_page * scale)
+        if count_page < 1:
+            continue
+        with pikepdf.open(SAMPLES_DIR / sample) as src, pikepdf.new() as dst:
+            for ii in range(count_page):
+                dst.pages.append(src.pages[ii % len(src.pages)])
+            outpath = Path(tmp_dir, f"{Path(sample).stem}-x{count_page}.pdf")
+            dst.save(outpath)
+        files.append(outpath)
+    return files
+
+
+# -----------------------------------------------------------------------------
+def _rasterize(pdf_path: Path, page_inds: list[int]) -> float | None:
+    "renders pages as OCR would see them, returns seconds spent, or None if pypdfium2 isn't installed"
+    if pdfextract.pypdfium2 is None:
+        return None
+    start = perf_counter()
+    pdf = pdfextract.pypdfium2.PdfDocument(pdf_path)
+    for page_ind in page_inds:
+        page = pdf[page_ind - 1]
+        page.render(scale=RASTER_DPI / 72).close()
+        page.close()
+    pdf.close()
+    return perf_counter() - start
+
+
+# -----------------------------------------------------------------------------
+def bench_document(pdf_path: Path, text_backend: str, cache_dir: str | None) -> dict:
+    "runs in a fresh child process: processes pdf_path once, returns its timings, page counts and peak RSS"
+    logging.disable(logging.CRITICAL)
+    pdfextract.CACHE_DIR = cache_dir
+
+    start = perf_counter()
+    result = pdfextract.process_file_or_url(pdf_path, text_backend=text_backend)
+    wall = perf_counter() - start
+    timings = {stage: pdfextract.stage_seconds(stage)[1] for stage in ["text_path", "ocr_path"]}
+
+    pages = result.get("pages", [])
+    ocr_inds = [p["page_ind"] for p in pages if p["route"] == "ocr"]
+    timings["rasterize"] = _rasterize(pdf_path, ocr_inds)
+    for output_format in SERIALIZE_FORMATS:
+        start = perf_counter()
+        if result["status"] == "success":
+            pdfextract.format_result(result, output_format)
+        timings[f"serialize_{output_format.lower()}"] = perf_counter() - start
+
+    peak_rss_kb = max(getrusage(RUSAGE_SELF).ru_maxrss, getrusage(RUSAGE_CHILDREN).ru_maxrss)
+    return {
+        "status": result["status"],
+        "count_page": result.get("count_page", 0),
+        "count_ocr_page": len(ocr_inds),
+        "wall": wall,
+        "pages_per_sec": result.get("count_page", 0) / wall if wall else None,
+        "stages": timings,
+        "peak_rss_mb": peak_rss_kb / 1024,
+        "cache": dict(pdfextract.CACHE_STATS),
+    }
+
+
+# -----------------------------------------------------------------------------
+def run_isolated(pdf_path: Path, text_backend: str, cache_dir: str | None) -> dict:
+    "runs bench_document in a new process, so peak RSS and module state are per document"
+    with get_context("spawn").Pool(1) as pool:
+        return pool.apply(bench_document, (pdf_path, text_backend, cache_dir))
+
+
+# -----------------------------------------------------------------------------
+def run_benchmark(files: list[Path], text_backends: list[str], repeat: int, cache: bool) -> list[dict]:
+    "benchmarks every file with every text backend, returns list of runs"
+    runs = []
+    with TemporaryDirectory(prefix="pdfextract_bench") as cache_dir:
+        for text_backend in text_backends:
+            for pdf_path in files:
+                best = min(
+                    (run_isolated(pdf_path, text_backend, None) for _ in range(max(1, repeat))),
+                    key=lambda r: r["wall"],
+                )
+                run = {"document": pdf_path.name, "text_backend": text_backend, **best}
+                if cache:
+                    run_isolated(pdf_path, text_backend, cache_dir)  # cold, fills cache
+                    warm = run_isolated(pdf_path, text_backend, cache_dir)
+                    run["cache"] = warm["cache"]
+                    run["cache_wall"] = warm["wall"]
+                runs.append(run)
+                logging.info(f"{pdf_path.name} {text_backend}: {run['wall']:.3f}s")
+    return runs
+
+
+# -----------------------------------------------------------------------------
+def compare(runs: list[dict], baseline: list[dict], max_regression: float) -> list[str]:
+    "takes runs and baseline runs, returns descriptions of documents that got slower by more than max_regression"
+    base = {(r["document"], r["text_backend"]): r for r in baseline}
+    regressions = []
+    for run in runs:
+        old = base.get((run["document"], run["text_backend"]))
+        if old is None or not old["wall"]:
+            continue
+        run["baseline_ratio"] = run["wall"] / old["wall"]
+        if run["baseline_ratio"] > 1 + max_regression:
+            regressions.append(
+                f"{run['document']} {run['text_backend']}: {old['wall']:.3f}s -> {run['wall']:.3f}s"
+            )
+    return regressions
+
+
+# -----------------------------------------------------------------------------
+def print_report(runs: list[dict]):
+    "writes a human-readable table of runs to stdout"
+    fmt = "{:<32} {:<14} {:>6} {:>5} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8} {:>8} {:>8}\n"
+    stdout.write(fmt.format("document", "backend", "pages", "ocr", "wall s", "pages/s",
+                            "text s", "ocr s", "raster s", "json s", "rss MB", "vs base"))
+    for r in runs:
+        s = r["stages"]
+        stdout.write(fmt.format(
+            r["document"][:32], r["text_backend"], r["count_page"], r["count_ocr_page"],
+            f"{r['wall']:.3f}", f"{r['pages_per_sec'] or 0:.1f}", f"{s['text_path']:.3f}",
+            f"{s['ocr_path']:.3f}",
+            "-" if s["rasterize"] is None else f"{s['rasterize']:.3f}",
+            f"{s['serialize_json']:.4f}", f"{r['peak_rss_mb']:.0f}",
+            f"{r['baseline_ratio']:.2f}x" if "baseline_ratio" in r else "-",
+        ))
+    cached = [r for r in runs if "cache_wall" in r]
+    if cached:
+        hits = sum(r["cache"]["hit"] for r in cached)
+        lookups = hits + sum(r["cache"]["miss"] for r in cached)
+        stdout.write(
+            f"cache: {hits}/{lookups} warm lookups hit,"
+            f" {sum(r['cache_wall'] for r in cached):.3f}s warm vs {sum(r['wall'] for r in cached):.3f}s cold\n"
+        )
+
+
+# -----------------------------------------------------------------------------
+def main():
+    "main function called when running the benchmark"
+    args = parse_params()
+    pdfextract.set_up_logging("ERROR", "STDERR")
+
+    with TemporaryDirectory(prefix="pdfextract_bench") as tmp_dir:
+        if args.files:
+            files = [Path(f) for f in args.files]
+        else:
+            files = pdfextract.list_dir(SAMPLES_DIR) + make_synthetic(tmp_dir, args.scale)
+        runs = run_benchmark(files, args.text_backends, args.repeat, args.cache)
+
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline, "r", encoding="utf-8") as rfp:
+            regressions = compare(runs, json.load(rfp)["runs"], args.max_regression)
+    print_report(runs)
+
+    if args.output is not None:
+        results = {
+            "environment": {
+                "python": version.split()[0],
+                "platform": platform.platform(),
+                "cpu_count": cpu_count(),
+                "ocrmypdf": ocrmypdf.__version__,
+                "pdfminer": pdfminer.__version__,
+            },
+            "runs": runs,
+        }
+        with open(args.output, "w", encoding="utf-8") as wfp:
+            json.dump(results, wfp, indent=2)
+
+    for regression in regressions:
+        logging.error(f"regression: {regression}")
+    exit(1 if regressions else 0)
+
+
+# -----------------------------------------------------------------------------
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+persistent job store for long-running PDF extraction requests
+Used by pdfextract_web to queue work, report per-file & per-page progress, and keep results
+Jobs are kept in a local SQLite file, so queued or interrupted work survives a restart
+"""
+
+from pathlib import Path
+from threading import Lock
+from time import time
+from uuid import uuid4
+
+import json
+import logging
+import os
+import sqlite3
+
+import pdfextract
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    langs TEXT,
+    timeout INTEGER,
+    text_backend TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    owner TEXT,
+    owner_pid INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    job_id TEXT NOT NULL REFERENCES jobs(id),
+    file_ind INTEGER NOT NULL,
+    location TEXT NOT NULL,
+    is_url INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    pages_done INTEGER NOT NULL DEFAULT 0,
+    pages_total INTEGER,
+    result TEXT,
+    PRIMARY KEY (job_id, file_ind)
+);
+"""
+# job & file status values
+QUEUED, RUNNING, DONE = "queued", "running", "done"
+# columns added since the first schema, for job files created before them
+_MIGRATIONS = {"jobs": [("owner", "TEXT"), ("owner_pid", "INTEGER")]}
+
+
+# -----------------------------------------------------------------------------
+def _pid_alive(pid: int | None) -> bool:
+    "returns whether a process with pid runs on this machine"
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # someone else's
+        return True
+    return True
+
+
+# -----------------------------------------------------------------------------
+class JobStore:
+    "SQLite-backed store of extraction jobs, the files in them, their progress and results"
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.owner = uuid4().hex  # this process, in claim_job()
+        self._lock = Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            for table, columns in _MIGRATIONS.items():
+                existing = {r["name"] for r in self._conn.execute(f"PRAGMA table_info({table})")}
+                for column, column_type in columns:
+                    if column not in existing:
+                        self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+    def _execute(self, sql: str, params: tuple = ()) -> list[sqlite3.Row]:
+        "runs one statement in its own transaction, returns fetched rows"
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params).fetchall()
+
+    def create_job(
+        self,
+        locations: list[Path | str],
+        langs: str | None,
+        timeout: int | None,
+        text_backend: str | None = None,
+    ) -> str:
+        "takes list of local Paths (files or directories) and URLs, stores them as a queued job, returns job id"
+        files = []
+        for loc in locations:
+            if isinstance(loc, Path):
+                if loc.is_dir():
+                    files.extend((str(p), False) for p in pdfextract.list_dir(loc))
+                elif loc.is_file():
+                    files.append((str(loc), False))
+            else:  # assuming URL
+                files.append((str(loc), True))
+
+        job_id = uuid4().hex
+        now = time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, langs, timeout, text_backend, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, langs, timeout, text_backend, now, now),
+            )
+            self._conn.executemany(
+                "INSERT INTO files (job_id, file_ind, location, is_url, status) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, ii, loc, is_url, QUEUED) for ii, (loc, is_url) in enumerate(files)],
+            )
+        return job_id
+
+    def get_job(self, job_id: str) -> dict | None:
+        "returns job status with per-file progress (without results), or None if no such job"
+        rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        job = dict(rows[0])
+        job["files"] = [
+            dict(r) for r in self._execute(
+                "SELECT file_ind, location, status, stage, pages_done, pages_total"
+                " FROM files WHERE job_id = ? ORDER BY file_ind",
+                (job_id,),
+            )
+        ]
+        job["count_file"] = len(job["files"])
+        job["count_done"] = sum(1 for f in job["files"] if f["status"] == DONE)
+        return job
+
+    def get_results(self, job_id: str, offset: int = 0, limit: int = 10) -> list[dict]:
+        "returns results of finished files in job, ordered as submitted, paginated with offset & limit"
+        rows = self._execute(
+            "SELECT result FROM files WHERE job_id = ? AND status = ?"
+            " ORDER BY file_ind LIMIT ? OFFSET ?",
+            (job_id, DONE, limit, offset),
+        )
+        return [json.loads(r["result"]) for r in rows]
+
+    def unfinished_jobs(self) -> list[str]:
+        "returns ids of jobs that are queued or were interrupted while running, oldest first"
+        rows = self._execute(
+            "SELECT id FROM jobs WHERE status != ? ORDER BY created", (DONE,)
+        )
+        return [r["id"] for r in rows]
+
+    def claim_job(self, job_id: str) -> bool:
+        """
+        marks job as running in this process, returns False if it's done, or claimed by another process that's still
+        alive. Safe with several server processes on one job file: only one of them gets a job
+        """
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT status, owner, owner_pid FROM jobs WHERE id = ?", (job_id,)
+            ).fetchall()
+            if not rows or rows[0]["status"] == DONE:
+                return False
+            owner, owner_pid = rows[0]["owner"], rows[0]["owner_pid"]
+            if owner not in [None, self.owner] and owner_pid != os.getpid() and _pid_alive(owner_pid):
+                return False  # a process with our pid but another owner is a dead one we replaced
+            claimed = self._conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, owner_pid = ?, updated = ?"
+                " WHERE id = ? AND status != ? AND owner IS ?",
+                (RUNNING, self.owner, os.getpid(), time(), job_id, DONE, owner),
+            )
+            return claimed.rowcount == 1
+
+    def set_job_status(self, job_id: str, status: str):
+        self._execute(
+            "UPDATE jobs SET status = ?, updated = ? WHERE id = ?", (status, time(), job_id)
+        )
+
+    def set_file_progress(
+        self, job_id: str, file_ind: int, stage: str, done: int, total: int | None
+    ):
+        self._execute(
+            "UPDATE files SET status = ?, stage = ?, pages_done = ?, pages_total = ?"
+            " WHERE job_id = ? AND file_ind = ?",
+            (RUNNING, stage, done, total, job_id, file_ind),
+        )
+
+    def set_file_result(self, job_id: str, file_ind: int, result: dict):
+        self._execute(
+            "UPDATE files SET status = ?, stage = NULL, pages_done = ?, pages_total = ?, result = ?"
+            " WHERE job_id = ? AND file_ind = ?",
+            (DONE, result.get("count_page", 0), result.get("count_page", 0),
+             json.dumps(result, default=str), job_id, file_ind),
+        )
+
+    def pending_files(self, job_id: str) -> list[tuple[int, Path | str]]:
+        "returns (file_ind, Path or URL) of files in job that don't have a result yet"
+        rows = self._execute(
+            "SELECT file_ind, location, is_url FROM files WHERE job_id = ? AND status != ?"
+            " ORDER BY file_ind",
+            (job_id, DONE),
+        )
+        return [
+            (r["file_ind"], r["location"] if r["is_url"] else Path(r["location"]))
+            for r in rows
+        ]
+
+
+# -----------------------------------------------------------------------------
+def run_job(store: JobStore, job_id: str):
+    "processes all files of job that don't have a result yet, recording progress and results in store"
+    job = store.get_job(job_id)
+    if job is None:
+        logging.error(f'job "{job_id}" not found')
+        return
+    if not store.claim_job(job_id):
+        logging.info(f'job "{job_id}" is done, or run by another server process')
+        return
+    logging.info(f'running job "{job_id}"')
+    for file_ind, resource in store.pending_files(job_id):
+
+        def progress(stage: str, done: int, total: int | None):
+            store.set_file_progress(job_id, file_ind, stage, done, total)
+
+        try:
+            result = pdfextract.process_sandboxed(
+                resource, job["langs"], job["timeout"], progress=progress,
+                text_backend=job["text_backend"],
+            )
+        except Exception as e:
+            logging.error(f'job "{job_id}" failed on "{resource}": {e}')
+            result = {"name": str(resource), "status": "fail", "error": str(e)}
+        store.set_file_result(job_id, file_ind, result)
+    store.set_job_status(job_id, DONE)
+    logging.info(f'job "{job_id}" done')
@@ -2,23 +2,42 @@
 web API for PDF text & OCR extraction
 Uses pdfextract module to provide features similar to command-line tool
 visit http://host:port/docs for API documentation
-Run with "-h" for usage
+Run with "-h" for usage. When imported by another server (e.g.; gunicorn or uvicorn with workers), it is configured
+from sample.ini, pdfextract.ini and PDFEXTRACT_* environment variables instead of the command line
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile
+from asyncio import get_running_loop, wrap_future
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from os import path
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from functools import partial
+from io import BytesIO
+from os import cpu_count, environ, path
 from pathlib import Path
 from pydantic import BaseModel, HttpUrl, field_validator
 from sys import stderr
+from time import sleep, time
 from tempfile import TemporaryDirectory
+from threading import BoundedSemaphore, Event, Lock, Thread
+from typing import Literal
+from uuid import uuid4
 import logging
+import os
+import signal
+import socket
 import uvicorn
 
 import pdfextract
+import pdfextract_jobs
 
 _SCRIPT_NAME_ = path.basename(__file__)
-args = pdfextract.parse_params(app_mode="WEBAPI")
+# argv belongs to whoever imported this module, unless it's run as a script
+args = pdfextract.parse_params(app_mode="WEBAPI", argv=None if __name__ == "__main__" else [])
+if args.server_workers < 1:
+    args.server_workers = max(1, (cpu_count() or 1) // args.workers)
 
 pdfextract.set_up_logging(
     args.log_level, "STDERR"
@@ -26,6 +45,208 @@ pdfextract.set_up_logging(
 
 # TODO: return meaningful error for bad langs or Tesseract timeout (from pdfextract module)
 
+# extraction runs in its own threads so the event loop stays responsive; requests beyond
+# the running + queued capacity are turned away with 503 instead of piling up
+RETRY_AFTER = 30  # seconds, suggested to clients turned away when the queue is full
+STREAM_OCR_CHUNK = 4  # pages OCR'd per OCRmyPDF run when streaming: first page sooner vs. per-run startup
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+RESPONSE_MEDIA_TYPES = {"JSON": "application/json", "XML": "application/xml", "ALTO": "application/xml"}
+_executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="pdfextract")
+_capacity = BoundedSemaphore(args.workers + args.queue_size)
+_count_lock = Lock()
+_count_accepted = 0
+_server = None  # uvicorn.Server of this process, when run by serve()
+_recycling = False  # this server process is shutting down to be replaced, see maybe_recycle()
+METRICS_INTERVAL = 5  # seconds between copies of this process' counters in args.metrics_dir
+_metrics_file = None  # that copy, see save_own_metrics()
+_metrics_file_lock = Lock()  # so an older copy never replaces a newer one
+pdfextract.CACHE_DIR = args.cache_dir
+pdfextract.CACHE_MAX_MB = args.cache_max_mb
+pdfextract.CACHE_MAX_AGE = args.cache_max_age
+pdfextract.DOWNLOAD_WORKERS = args.download_workers
+pdfextract.DOWNLOAD_MAX_MB = args.download_max_mb
+pdfextract.UPLOAD_MAX_MB = args.upload_max_mb
+pdfextract.OCR_ENGINE = args.ocr_engine
+pdfextract.OCR_PAGE_WORKERS = args.ocr_page_workers
+pdfextract.OCR_PAGE_TIMEOUT = args.ocr_page_timeout or None
+pdfextract.OCR_MAX_DPI = args.ocr_max_dpi
+pdfextract.OCR_MAX_MPIXELS = args.ocr_max_mpixels
+pdfextract.TRIAGE = not args.no_triage
+pdfextract.FILE_TIMEOUT = args.file_timeout
+pdfextract.FILE_MAX_RSS_MB = args.file_max_rss_mb
+pdfextract.FILE_MAX_PAGES = args.file_max_pages
+pdfextract.FILE_MAX_MPIXELS = args.file_max_mpixels
+# split cores between concurrent OCR runs of all server processes, so OCRmyPDF doesn't oversubscribe them
+pdfextract.OCR_JOBS = max(1, (cpu_count() or 1) // (args.workers * args.server_workers))
+
+
+# -----------------------------------------------------------------------------
+def acquire_capacity():
+    "takes a running/queued slot for an extraction request, raises HTTP 503 if the queue is full"
+    global _count_accepted
+    if not _capacity.acquire(blocking=False):
+        logging.error("extraction queue full, rejecting request")
+        pdfextract.add_metric("rejected_requests_total")
+        raise HTTPException(
+            status_code=503,
+            detail="server busy, please retry later",
+            headers={"Retry-After": str(RETRY_AFTER)},
+        )
+    with _count_lock:
+        _count_accepted += 1
+
+
+def release_capacity():
+    global _count_accepted
+    with _count_lock:
+        _count_accepted -= 1
+    _capacity.release()
+    if args.metrics_dir:  # the request's counts, in /metrics of every process
+        save_own_metrics()
+    maybe_recycle()
+
+
+# -----------------------------------------------------------------------------
+def maybe_recycle():
+    "asks this server process to shut down gracefully, to be replaced, once it processed args.recycle_documents"
+    global _recycling
+    if not args.recycle_documents or _server is None or _recycling:
+        return
+    count_document = sum(
+        value for (name, _), value in list(pdfextract.METRICS.items()) if name == "documents_total"
+    )
+    if count_document >= args.recycle_documents:
+        logging.info(f"server process {os.getpid()} processed {count_document} documents, recycling it")
+        _recycling = True
+        _server.should_exit = True
+
+
+# -----------------------------------------------------------------------------
+async def run_extraction(func, *func_args, **kwargs):
+    "runs blocking pdfextract func in the extraction executor, raises HTTP 503 if the queue is full"
+    acquire_capacity()
+    try:
+        return await get_running_loop().run_in_executor(
+            _executor, partial(func, *func_args, **kwargs)
+        )
+    finally:
+        release_capacity()
+
+
+# -----------------------------------------------------------------------------
+def format_response(result: dict | list, output_format: str, layout: str | None) -> Response:
+    """
+    takes extraction result (a processed PDF dictionary, or list of them), returns it serialized in output_format
+    and layout as HTTP response. Failed PDFs have no text for ALTO, they are returned as JSON
+    """
+    if output_format == "ALTO" and result.get("status") != "success":
+        output_format = "JSON"
+    if output_format == "JSON":
+        if isinstance(result, list):
+            content = pdfextract.dump_json([pdfextract.layout_result(r, layout) for r in result])
+        else:
+            content = pdfextract.dump_json(pdfextract.layout_result(result, layout))
+    else:
+        buffer = BytesIO()
+        if output_format == "ALTO":
+            pdfextract.write_alto(result, buffer)
+        else:
+            pdfextract.write_xml(
+                result if isinstance(result, list) else [result], buffer, layout, single=isinstance(result, dict)
+            )
+        content = buffer.getvalue()
+    return Response(content=content, media_type=RESPONSE_MEDIA_TYPES[output_format])
+
+
+# -----------------------------------------------------------------------------
+def extract_response(func, output_format: str, layout: str | None, *func_args, **kwargs) -> Response:
+    "runs blocking pdfextract func, returns its result as format_response(), so serializing also runs off the event loop"
+    return format_response(func(*func_args, **kwargs), output_format, layout)
+
+
+# -----------------------------------------------------------------------------
+def format_stream_item(item: dict, stream: str, layout: str | None = None) -> str:
+    """
+    takes item yielded by pdfextract.iter_file_or_url, returns it as an NDJSON line or Server-Sent Event.
+    pages are sent one by one in every layout, 'text' sends them as 'compact' does
+    """
+    if "page_ind" in item and layout in ["compact", "text"]:
+        item = pdfextract.layout_page(item, "compact")
+    data = pdfextract.dump_json(item)
+    if stream == "ndjson":
+        return data + "\n"
+    if "page_ind" in item:
+        event = "page"
+    elif "status" in item:
+        event = "end"
+    else:
+        event = "document"
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+# -----------------------------------------------------------------------------
+def close_items(items: Iterator[dict], pending: Future | None):
+    """
+    closes items in the extraction executor, once its pending next() (if any) finished there: a cancelled await
+    doesn't stop the thread, and closing a generator that's still running raises ValueError
+    """
+    if pending is None:
+        _executor.submit(items.close)
+    else:
+        pending.add_done_callback(lambda _: _executor.submit(items.close))
+
+
+# -----------------------------------------------------------------------------
+async def stream_extraction(first: dict, items: Iterator[dict], stream: str, layout: str | None = None):
+    "yields first and the rest of items formatted for stream, advancing items in the extraction executor"
+    pending = None
+    try:
+        item = first
+        while item is not None:
+            yield format_stream_item(item, stream, layout)
+            pending = _executor.submit(next, items, None)
+            item = await wrap_future(pending)
+    finally:
+        try:
+            close_items(items, pending)  # removes temporary copy of the PDF if the client went away
+        finally:
+            release_capacity()
+
+
+# -----------------------------------------------------------------------------
+def process_locations(
+    locations: list, langs: str | None, timeout: int | None, backend: str | None = None
+) -> list:
+    """
+    takes list of Paths and HttpUrls, processes them as PDFs (directories file by file), returns list of results.
+    each PDF runs in a sandbox child process if per-document limits are set, see pdfextract.iter_sandboxed
+    """
+    results = []
+    for loc in pdfextract.iter_prefetched(locations):
+        if isinstance(loc, Path) and loc.is_dir():
+            files = pdfextract.list_dir(loc)
+        elif isinstance(loc, Path) and not loc.is_file():
+            continue
+        else:  # file, or assuming HttpUrl
+            files = [loc]
+        for file in files:
+            results.append(
+                pdfextract.process_sandboxed(
+                    file, languages=langs, tesseract_timeout=timeout, text_backend=backend
+                )
+            )
+    return results
+
+
+# -----------------------------------------------------------------------------
+def check_backend(backend: str | None):
+    "raises HTTP 422 if text backend isn't known or its module isn't installed"
+    if backend is not None and backend not in pdfextract.available_text_backends():
+        raise HTTPException(
+            status_code=422,
+            detail=f"backend must be one of {', '.join(pdfextract.available_text_backends())}",
+        )
+
 
 # -----------------------------------------------------------------------------
 class Location(BaseModel):
@@ -43,73 +264,349 @@ class Location(BaseModel):
 
 
 # -----------------------------------------------------------------------------
-app = FastAPI()
+_job_executor = ThreadPoolExecutor(
+    max_workers=args.job_workers, thread_name_prefix="pdfextract_job"
+)
+_job_store = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    opens the job store, and requeues jobs left queued or interrupted by the last shutdown or a server process that
+    died. Every server process does, JobStore.claim_job() lets only one of them run each job
+    """
+    global _job_store
+    _job_store = pdfextract_jobs.JobStore(args.job_db)
+    for job_id in _job_store.unfinished_jobs():
+        logging.info(f'requeueing job "{job_id}"')
+        _job_executor.submit(pdfextract_jobs.run_job, _job_store, job_id)
+    stop_saving = Event()
+    if args.metrics_dir:
+        Thread(target=save_metrics_loop, args=(stop_saving,), daemon=True, name="pdfextract_metrics").start()
+    yield
+    # a recycled process finishes its jobs first, nothing would requeue them until the next server start
+    _job_executor.shutdown(wait=_recycling, cancel_futures=not _recycling)
+    if args.metrics_dir:
+        stop_saving.set()
+        save_own_metrics()  # final counts, which keep adding up in /metrics after this process is gone
+
+
+# -----------------------------------------------------------------------------
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=args.cors_origin if isinstance(args.cors_origin, list) else [args.cors_origin],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    "refuses uploads with HTTP 413 from their Content-Length, before the body is read"
+    content_length = request.headers.get("content-length", "")
+    if (
+        request.url.path == "/upload"
+        and content_length.isdigit()
+        and int(content_length) > args.upload_max_mb * (1 << 20)
+    ):
+        return JSONResponse(
+            status_code=413, content={"detail": f"upload is over the {args.upload_max_mb} MB limit"}
+        )
+    return await call_next(request)
+
+
 @app.post("/location")
 async def pdfextract_list(
-    locations: list[Location], timeout: int | None = None, langs: str | None = None
+    locations: list[Location],
+    timeout: int | None = None,
+    langs: str | None = None,
+    backend: str | None = None,
+    format: Literal["JSON", "XML"] = "JSON",
+    layout: Literal["pages", "compact", "text"] | None = None,
 ):
-    "takes a list of strings, initializes them as Location objects, then processes them as PDFs to extract text, etc,.. returns JSON HTTP response"
+    "takes a list of strings, initializes them as Location objects, then processes them as PDFs to extract text, etc,.. returns JSON or XML HTTP response"
     # TODO: should this be limited to localhost or certain dirs? for now filesystem perms are per user running this script
-    results = []
-    for loc in [l.url_or_path for l in locations]:
-        if isinstance(loc, Path):
-            if loc.is_file():
-                results.append(
-                    pdfextract.process_file_or_url(
-                        loc, languages=langs, tesseract_timeout=timeout
-                    )
-                )
-            elif loc.is_dir():
-                results.extend(
-                    pdfextract.process_dir(
-                        loc, languages=langs, tesseract_timeout=timeout
-                    )
-                )
-        else:  # assuming HttpUrl
-            results.append(
-                pdfextract.process_file_or_url(
-                    loc, languages=langs, tesseract_timeout=timeout
-                )
-            )
-    return results
+    check_backend(backend)
+    return await run_extraction(
+        extract_response, process_locations, format, layout, [l.url_or_path for l in locations], langs, timeout,
+        backend,
+    )
 
 
 # -----------------------------------------------------------------------------
 @app.post("/upload")
 async def pdfextract_upload(
-    file: UploadFile, timeout: int | None = None, langs: str | None = None
+    file: UploadFile,
+    timeout: int | None = None,
+    langs: str | None = None,
+    backend: str | None = None,
+    stream: Literal["ndjson", "sse"] | None = None,
+    format: Literal["JSON", "XML", "ALTO"] = "JSON",
+    layout: Literal["pages", "compact", "text"] | None = None,
 ):
-    "takes PDF file upload as HTTP multi-part request, extracts text, etc,.. returns JSON HTTP response"
+    """
+    takes PDF file upload as HTTP multi-part request, extracts text, etc,.. returns JSON HTTP response.
+    format XML or ALTO (v4, text without coordinates) return XML instead, layout compact or text leave out
+    text_path / ocr_path, see pdfextract.OUTPUT_LAYOUTS.
+    with stream set, each page is sent as soon as it's ready instead, as NDJSON lines or Server-Sent Events.
+    the upload is spooled to disk as it arrives, and copied from there in chunks, never held in memory whole
+    """
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=422, detail="upload must be a PDF file")
-    return pdfextract.process_file_or_url(
-        file, languages=langs, tesseract_timeout=timeout
+    if file.size is not None and file.size > args.upload_max_mb * (1 << 20):  # sent without Content-Length
+        raise HTTPException(status_code=413, detail=f"upload is over the {args.upload_max_mb} MB limit")
+    check_backend(backend)
+    if stream is None:
+        return await run_extraction(
+            extract_response, pdfextract.process_sandboxed, format, layout, file, languages=langs,
+            tesseract_timeout=timeout, text_backend=backend,
+        )
+
+    acquire_capacity()
+    items = pdfextract.iter_sandboxed(
+        file, languages=langs, tesseract_timeout=timeout, ocr_chunk=STREAM_OCR_CHUNK,
+        text_backend=backend,
+    )
+    pending = _executor.submit(next, items)  # reads the upload before the request ends and it's closed
+    try:
+        first = await wrap_future(pending)
+    except BaseException:
+        try:
+            close_items(items, pending)
+        finally:
+            release_capacity()
+        raise
+    return StreamingResponse(
+        stream_extraction(first, items, stream, layout), media_type=STREAM_MEDIA_TYPES[stream]
     )
 
 
 # -----------------------------------------------------------------------------
-if __name__ == "__main__":
-    "main function called when script is run, parsed cmdline args, inits logging, then starts app with uvicorn"
-    uvicorn_loglevel = (
-        "critical" if args.log_level == "QUIET" else args.log_level.lower()
+@app.post("/inspect")
+async def pdfextract_inspect(file: UploadFile):
+    "takes PDF file upload, returns its triage (page count, page kinds, image DPI, encryption, corruption, cost estimate) without extracting text"
+    if file.content_type != "application/pdf":
+        raise HTTPException(status_code=422, detail="upload must be a PDF file")
+    # cheap enough to skip the extraction queue
+    return await get_running_loop().run_in_executor(None, pdfextract.inspect_file_or_url, file)
+
+
+# -----------------------------------------------------------------------------
+@app.post("/inspect/location")
+async def pdfextract_inspect_list(locations: list[Location]):
+    "like /location, but returns the triage of each PDF, see /inspect"
+    resources = []
+    for loc in [l.url_or_path for l in locations]:
+        if isinstance(loc, Path) and loc.is_dir():
+            resources.extend(pdfextract.list_dir(loc))
+        elif not isinstance(loc, Path) or loc.is_file():
+            resources.append(loc)
+    return await get_running_loop().run_in_executor(
+        None, lambda: [pdfextract.inspect_file_or_url(r) for r in pdfextract.iter_prefetched(resources)]
     )
 
-    print(f"uvicorn_loglevel: {uvicorn_loglevel}", file=stderr)
 
-    # TODO: this is a dev server... use with Gunicorn or ? ( and reload=False) in production
-    uvicorn.run(
-        "pdfextract_web:app",
-        host=args.host,
-        port=args.port,
-        log_level=uvicorn_loglevel,
-        reload=True,
+# -----------------------------------------------------------------------------
+@app.post("/jobs")
+async def pdfextract_job_submit(
+    locations: list[Location],
+    timeout: int | None = None,
+    langs: str | None = None,
+    backend: str | None = None,
+):
+    "like /location, but queues the locations as a job and returns its id right away, see /jobs/{job_id}"
+    check_backend(backend)
+    job_id = await get_running_loop().run_in_executor(
+        None, _job_store.create_job, [l.url_or_path for l in locations], langs, timeout, backend
     )
+    _job_executor.submit(pdfextract_jobs.run_job, _job_store, job_id)
+    return {"job_id": job_id}
+
+
+# -----------------------------------------------------------------------------
+@app.get("/jobs/{job_id}")
+async def pdfextract_job_status(job_id: str):
+    "returns job status, with per-file status, stage (text or ocr) and pages done"
+    job = _job_store.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="no such job")
+    return job
+
+
+# -----------------------------------------------------------------------------
+@app.get("/jobs/{job_id}/results")
+async def pdfextract_job_results(job_id: str, offset: int = 0, limit: int = 10):
+    "returns results of finished files in job, as /location would, limit at a time starting at offset"
+    if _job_store.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="no such job")
+    return _job_store.get_results(job_id, max(0, offset), max(1, min(limit, 100)))
+
+
+# -----------------------------------------------------------------------------
+def save_own_metrics():
+    "copies this process' counters, and its accepted requests, to its file in args.metrics_dir"
+    global _metrics_file
+    with _metrics_file_lock:
+        if _metrics_file is None:  # a fresh name, never one of a process that exited (even with the same pid)
+            _metrics_file = path.join(args.metrics_dir, f"{os.getpid()}-{uuid4().hex[:8]}.json")
+        try:
+            pdfextract.save_metrics(_metrics_file, accepted=_count_accepted)
+        except OSError as e:
+            logging.error(f'failed to write metrics file "{_metrics_file}": {e}')
+
+
+# -----------------------------------------------------------------------------
+def save_metrics_loop(stop: Event):
+    "runs in a thread of each server process: calls save_own_metrics() every METRICS_INTERVAL, until stop is set"
+    while not stop.wait(METRICS_INTERVAL):
+        save_own_metrics()
+
+
+# -----------------------------------------------------------------------------
+def all_metrics() -> tuple[dict, int]:
+    """
+    returns counters summed over the server processes sharing args.metrics_dir (including ones that exited, so
+    they only grow), and requests accepted by those still running. Without a metrics_dir, this process' own
+    """
+    if not args.metrics_dir:
+        return pdfextract.METRICS, _count_accepted
+    save_own_metrics()
+    metrics, count_accepted = {}, 0
+    for file_path in Path(args.metrics_dir).glob("*.json"):
+        try:
+            counters, extra = pdfextract.load_metrics(file_path)
+            recent = time() - file_path.stat().st_mtime < 3 * METRICS_INTERVAL
+        except (OSError, ValueError) as e:
+            logging.error(f'failed to read metrics file "{file_path}": {e}')
+            continue
+        for key, value in counters.items():
+            metrics[key] = metrics.get(key, 0) + value
+        if recent:  # not left by a process that died
+            count_accepted += extra.get("accepted", 0)
+    return metrics, count_accepted
+
+
+# -----------------------------------------------------------------------------
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    returns stage durations, page, document, download and cache counters in Prometheus text format, summed over
+    all server processes if they share a metrics_dir
+    """
+    counters, count_accepted = await get_running_loop().run_in_executor(None, all_metrics)
+    return PlainTextResponse(
+        pdfextract.format_prometheus(counters)
+        + "# TYPE pdfextract_requests_accepted gauge\n"
+        + f"pdfextract_requests_accepted {count_accepted}\n",
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+# -----------------------------------------------------------------------------
+@app.get("/health")
+async def health():
+    "answers even while extraction is busy, reports how many requests are running or queued"
+    return {"status": "ok", "accepted": _count_accepted,
+            "capacity": args.workers + args.queue_size}
+
+
+# -----------------------------------------------------------------------------
+def serve(sock: socket.socket | None = None):
+    "runs the app in this process with uvicorn, on sock if given (shared with other server processes)"
+    global _server
+    _server = uvicorn.Server(uvicorn.Config(
+        app, host=args.host, port=args.port, log_level=_uvicorn_log_level()
+    ))
+    _server.run(sockets=None if sock is None else [sock])
+
+
+# -----------------------------------------------------------------------------
+def _uvicorn_log_level() -> str:
+    return "critical" if args.log_level == "QUIET" else args.log_level.lower()
+
+
+# -----------------------------------------------------------------------------
+def run_server_workers(count: int):
+    """
+    pre-fork server: binds the port, then forks count server processes that share it and the modules already
+    imported (pdfminer, OCRmyPDF, ...). One that exits, e.g.; recycled after args.recycle_documents, is replaced.
+    stops them all on SIGINT or SIGTERM
+    """
+    sock = socket.create_server((args.host, args.port))
+    sock.set_inheritable(True)
+    metrics_dir = None
+    if not args.metrics_dir:  # so /metrics adds up the processes, see all_metrics()
+        metrics_dir = TemporaryDirectory(prefix="pdfextract_metrics_")
+        args.metrics_dir = metrics_dir.name
+    children = {}  # pid -> index
+    stopping = False
+
+    def start(index: int):
+        pid = os.fork()
+        if pid == 0:
+            os.setpgrp()  # so Ctrl+C only reaches this process through the parent, once
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                serve(sock)
+            finally:
+                os._exit(0)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    logging.info(f"starting {count} server processes on {args.host}:{args.port}")
+    for index in range(count):
+        start(index)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid)
+        if not stopping:
+            logging.info(f"server process {pid} exited with status {os.waitstatus_to_exitcode(status)}, replacing it")
+            sleep(0.1)  # don't spin if processes die right away
+            start(index)
+    sock.close()
+    if metrics_dir is not None:
+        metrics_dir.cleanup()
+
+
+# -----------------------------------------------------------------------------
+if __name__ == "__main__":
+    "main function called when script is run, parsed cmdline args, inits logging, then starts app with uvicorn"
+    print(f"uvicorn_loglevel: {_uvicorn_log_level()}", file=stderr)
+
+    if args.reload:  # development server, the reloaded process imports this module and can't see argv
+        for key, value in vars(args).items():
+            if value is not None:
+                environ[pdfextract.ENV_PREFIX + key.upper()] = (
+                    " ".join(value) if isinstance(value, list) else str(value)
+                )
+        uvicorn.run(
+            "pdfextract_web:app",
+            host=args.host,
+            port=args.port,
+            log_level=_uvicorn_log_level(),
+            reload=True,
+        )
+    elif args.server_workers == 1 and not args.recycle_documents:
+        serve()
+    else:
+        run_server_workers(args.server_workers)
@@ -0,0 +1,160 @@
+"""
+tests of pdfextract.Downloader against a local HTTP server: redirects, ETag revalidation, the size limit,
+rejected non-PDF responses and keep-alive connection reuse. Offline, run with `python -m unittest` or pytest
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest import TestCase, main, mock
+
+import os
+
+import pdfextract
+
+PDF = b"%PDF-1.4\n" + b"%" * 2000 + b"\n%%EOF\n"
+ETAG = '"v1"'
+MB = 1 << 20
+
+
+# -----------------------------------------------------------------------------
+class Handler(BaseHTTPRequestHandler):
+    "serves the test routes over HTTP/1.1 keep-alive, recording (path, headers, client port) of each request"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers), self.client_address[1]))
+        if self.path == "/doc.pdf":
+            if self.headers.get("If-None-Match") == ETAG:
+                self.send_response(304)
+                self.send_header("ETag", ETAG)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_body(PDF, "application/pdf", ETag=ETAG)
+        elif self.path == "/redirect":
+            self.send_redirect("/doc.pdf")
+        elif self.path == "/loop":
+            self.send_redirect("/loop")
+        elif self.path == "/page.html":
+            self.send_body(b"<html>not found, sorry</html>", "text/html")
+        elif self.path == "/junk.pdf":
+            self.send_body(b"x" * 4096, "application/octet-stream")
+        elif self.path == "/big.pdf":  # announced too large
+            self.send_body(PDF + b" " * (2 * MB), "application/pdf")
+        elif self.path == "/big-unannounced.pdf":  # too large, without a Content-Length
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(PDF + b" " * (2 * MB))
+            self.close_connection = True
+        else:
+            self.send_body(b"missing", "text/plain", status=404)
+
+    def send_body(self, body: bytes, content_type: str, status: int = 200, **headers):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):  # the client stopped reading, as it should
+            self.close_connection = True
+
+    def send_redirect(self, location: str):
+        self.send_response(302)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+# -----------------------------------------------------------------------------
+class DownloaderTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        cls.server.daemon_threads = True
+        cls.server.requests = []
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.requests.clear()
+        patches = [
+            mock.patch.dict(os.environ, {"no_proxy": "*", "NO_PROXY": "*"}),  # the test server is local
+            mock.patch.object(pdfextract, "CACHE_DIR", None),
+            mock.patch.object(pdfextract, "DOWNLOAD_MAX_MB", 1),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.downloader = pdfextract.Downloader(2)
+
+    def fetch(self, route: str) -> bytes | None:
+        "returns the content downloaded from route, or None if the download failed or was rejected"
+        file_name = self.downloader.fetch(self.base + route)
+        if file_name is None:
+            return None
+        try:
+            return Path(file_name).read_bytes()
+        finally:
+            os.remove(file_name)
+
+    def test_download(self):
+        self.assertEqual(self.fetch("/doc.pdf"), PDF)
+
+    def test_redirect(self):
+        self.assertEqual(self.fetch("/redirect"), PDF)
+        self.assertEqual([r[0] for r in self.server.requests], ["/redirect", "/doc.pdf"])
+
+    def test_redirect_loop(self):
+        self.assertIsNone(self.fetch("/loop"))
+        self.assertEqual(len(self.server.requests), pdfextract.DOWNLOAD_MAX_REDIRECTS + 1)
+
+    def test_revalidate(self):
+        with TemporaryDirectory() as cache_dir, mock.patch.object(pdfextract, "CACHE_DIR", cache_dir):
+            self.assertEqual(self.fetch("/doc.pdf"), PDF)
+            self.assertEqual(self.fetch("/doc.pdf"), PDF)  # from the cached copy, after a 304
+        self.assertNotIn("If-None-Match", self.server.requests[0][1])
+        self.assertEqual(self.server.requests[1][1].get("If-None-Match"), ETAG)
+
+    def test_size_limit(self):
+        self.assertIsNone(self.fetch("/big.pdf"))
+        self.assertIsNone(self.fetch("/big-unannounced.pdf"))
+
+    def test_reject_not_pdf(self):
+        self.assertIsNone(self.fetch("/page.html"))  # content type
+        self.assertIsNone(self.fetch("/junk.pdf"))  # first bytes
+        self.assertIsNone(self.fetch("/missing.pdf"))
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            self.assertEqual(self.fetch("/doc.pdf"), PDF)
+        self.assertEqual(len({r[2] for r in self.server.requests}), 1)  # one connection, from one client port
+
+    def test_prefetch(self):
+        url = self.base + "/doc.pdf"
+        self.downloader.prefetch(url)
+        file_name = self.downloader.take(url)
+        try:
+            self.assertEqual(Path(file_name).read_bytes(), PDF)
+        finally:
+            os.remove(file_name)
+        self.assertEqual(len(self.server.requests), 1)
+
+
+if __name__ == "__main__":
+    main()